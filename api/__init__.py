@@ -0,0 +1 @@
+"""PES Embroidery API"""
@@ -14,16 +14,28 @@ PORT = 8009
 
 # File settings
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
-ALLOWED_EXTENSIONS = [".pes", ".dst", ".jef", ".exp", ".vp3", ".xxx", ".pec", ".hus", ".vip"]
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+# Directory for temp files (None = system temp dir). Set e.g. SCRATCH_DIR=/dev/shm
+# to keep them in RAM, only if that tmpfs is sized for MAX_FILE_SIZE uploads times
+# concurrent requests/batch files (Docker's default /dev/shm is 64MB)
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or None
+ALLOWED_EXTENSIONS = frozenset({".pes", ".dst", ".jef", ".exp", ".vp3", ".xxx", ".pec", ".hus", ".vip"})
 
 # Processing settings
 DEFAULT_PREVIEW_SIZE = 400
 DEFAULT_MAX_SIZE = 800
 DEFAULT_LINEWIDTH = 2
 DOWNLOAD_TIMEOUT = 30.0
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "20"))  # URL downloads in flight per worker
+BATCH_MAX_CONCURRENCY = 16  # PES files processed at once per batch worker
+PES_DATA_CACHE_SIZE = 256  # Converted JSON payloads kept in memory per worker
+NEEDLE_CACHE_FLUSH_INTERVAL = 2.0  # Seconds between needle cache writes
 
 # Supported output formats
-SUPPORTED_FORMATS = [".dst", ".pes", ".jef", ".exp", ".vp3", ".xxx", ".pec", ".hus", ".vip"]
+SUPPORTED_FORMATS = frozenset({".dst", ".pes", ".jef", ".exp", ".vp3", ".xxx", ".pec", ".hus", ".vip"})
 
 # Backblaze B2 Configuration
 B2_ACCESS_KEY_ID = os.getenv("B2_ACCESS_KEY_ID", "005fa7d122849800000000002")
@@ -32,8 +44,13 @@ B2_DEFAULT_REGION = os.getenv("B2_DEFAULT_REGION", "us-east-005")
 B2_BUCKET = os.getenv("B2_BUCKET", "Lemiex-Fulfillment")
 B2_ENDPOINT = os.getenv("B2_ENDPOINT", "https://s3.us-east-005.backblazeb2.com")
 B2_URL_CLOUD = os.getenv("B2_URL_CLOUD", "https://zipimgs.com/file/Lemiex-Fulfillment")
+B2_MAX_POOL_CONNECTIONS = 64
+B2_MAX_ATTEMPTS = 3
+B2_DELETE_BATCH_SIZE = 1000  # S3 delete_objects limit
+B2_UPLOAD_CONCURRENCY = 32  # Uploads in flight per batch worker
 
 # Output paths on B2
 B2_JSON_OUTPUT_PATH = "converted_json"
 B2_DST_OUTPUT_PATH = "converted_dst"
 B2_INFO_IMAGE_PATH = "info_images"
+B2_PREVIEW_PATH = "previews"
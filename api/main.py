@@ -3,25 +3,54 @@ PES Embroidery API Service
 FastAPI-based REST API for PES file conversion and preview
 """
 
+import asyncio
 import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-# Add parent directory to path for imports
-sys.path.insert(0, str(Path(__file__).parent.parent))
-sys.path.insert(0, str(Path(__file__).parent))
+# Entry point: make the repo-root converters and the API modules importable
+# (only here, once; the other modules never touch sys.path)
+_API_DIR = Path(__file__).resolve().parent
+for _path in (str(_API_DIR.parent), str(_API_DIR)):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from config import CORS_ORIGINS, CORS_CREDENTIALS, CORS_METHODS, CORS_HEADERS, HOST, PORT
 from routes import convert, preview, format, convert_b2, batch_convert
+from routes.batch_convert import shutdown_executor
+from services.file_handler import ContentLengthLimitMiddleware
+from services.b2_storage import open_b2_client, close_b2_client
+from services.http_client import close_http_client
+from services.pes_converter import flush_needle_cache, run_needle_cache_flusher
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared clients and the needle cache flusher on startup; flush and close on shutdown"""
+    await open_b2_client()
+    flusher = asyncio.create_task(run_needle_cache_flusher())
+    yield
+    flusher.cancel()
+    await flush_needle_cache()
+    await close_b2_client()
+    await close_http_client()
+    shutdown_executor()
+
 
 app = FastAPI(
     title="PES Embroidery API",
     description="API service for converting PES embroidery files to JSON and generating previews",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+# Oversized uploads are refused before their body is read (added before CORS
+# so the 413 still carries CORS headers)
+app.add_middleware(ContentLengthLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
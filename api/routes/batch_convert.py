@@ -1,34 +1,69 @@
 """Batch convert PES to DST and upload to B2"""
 
 import asyncio
+import multiprocessing
 import os
-import sys
-import tempfile
-from pathlib import Path
+import shutil
 from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
-
-sys.path.insert(0, str(Path(__file__).parent.parent))
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from concurrent.futures import ProcessPoolExecutor
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from pyembroidery import read, write as write_embroidery
 
-from services.file_handler import download_from_url, cleanup_temp_file
+from config import BATCH_MAX_CONCURRENCY, B2_UPLOAD_CONCURRENCY
+from services.file_handler import (
+    download_from_url,
+    filename_from_url,
+    make_temp_dir,
+    make_temp_path,
+)
 from services.b2_storage import (
     upload_dst_to_b2,
     upload_image_to_b2,
-    extract_filename_from_url,
     delete_from_b2,
     delete_multiple_from_b2,
 )
-from render_pes_trueview import render_pes
+from services.batch_jobs import convert_pes_sync
 
 router = APIRouter()
 
-# Thread pool for CPU-bound tasks
-executor = ThreadPoolExecutor(max_workers=4)
+# Process pool for CPU-bound tasks (pyembroidery parsing holds the GIL),
+# created on first use
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Get the shared process pool, sized to the CPU count
+    
+    Workers come from a forkserver: forking this multithreaded server
+    directly (event loop, to_thread workers, client threads) can copy
+    locks held by other threads into the child. The forkserver preloads
+    __main__ (the app), so nothing the app does at import may leave state
+    behind: the scratch workdir is only created on first use.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Shut down the process pool (called on app shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+# Caps files being downloaded/converted across all batches
+_batch_semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+# Caps B2 uploads in flight across all batches
+_upload_semaphore = asyncio.Semaphore(B2_UPLOAD_CONCURRENCY)
 
 
 class PesFileInput(BaseModel):
@@ -55,126 +90,62 @@ class BatchConvertResponse(BaseModel):
     files: List[FileOutput]
 
 
-def process_single_file_sync(
-    pes_path: str,
-    base_name: str,
-    include_dst: bool,
-) -> tuple:
-    """
-    Synchronous processing of a single PES file (for thread pool)
-    Returns: (dst_path, png_path, stitch_count)
-    """
-    # Read pattern
-    pattern = read(pes_path)
-    if pattern is None:
-        raise ValueError(f"Unable to read PES file")
-    
-    stitch_count = pattern.count_stitches()
-    
-    dst_path = None
-    png_path = None
-    
-    # Convert to DST
-    if include_dst:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".dst") as tmp:
-            dst_path = tmp.name
-        write_embroidery(pattern, dst_path)
-    
-    # Generate preview image
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        png_path = tmp.name
-    
-    render_pes(
-        pes_path=Path(pes_path),
-        png_path=Path(png_path),
-        background=None,
-        linewidth=1,  # Thinner = faster
-        margin=0,
-        max_size=400,  # Smaller for speed
-        native_size=True,
-        output_base64=False,
-    )
-    
-    return dst_path, png_path, stitch_count
+class ConvertedFile(BaseModel):
+    """Local outputs of one converted PES file, waiting to be uploaded"""
+    pes_input: PesFileInput
+    base_name: str
+    dst_path: Optional[str] = None
+    png_path: str
+    stitch_count: int
 
 
 async def process_single_pes(
     pes_input: PesFileInput,
     include_dst: bool,
+    batch_dir: str,
     loop: asyncio.AbstractEventLoop,
-) -> tuple:
+) -> ConvertedFile:
     """
-    Process a single PES file asynchronously
-    Returns: (FileOutput, temp_files_to_cleanup, uploaded_urls)
+    Download and convert a single PES file asynchronously (no uploads)
+    All temp files are written to batch_dir
     """
-    temp_files = []
-    uploaded_urls = []  # Track uploaded URLs for rollback
-    
-    # Download PES file
-    tmp_pes_path = await download_from_url(pes_input.url)
-    temp_files.append(tmp_pes_path)
-    
-    # Extract base filename
-    original_filename = extract_filename_from_url(pes_input.url)
-    base_name = original_filename.rsplit(".", 1)[0]
-    
-    # Process in thread pool (CPU-bound)
-    dst_path, png_path, stitch_count = await loop.run_in_executor(
-        executor,
-        process_single_file_sync,
-        tmp_pes_path,
-        base_name,
-        include_dst,
-    )
-    
-    if dst_path:
-        temp_files.append(dst_path)
-    if png_path:
-        temp_files.append(png_path)
-    
-    # Upload to B2 concurrently
-    upload_tasks = []
-    
-    if include_dst and dst_path:
-        upload_tasks.append(
-            loop.run_in_executor(
-                executor,
-                upload_dst_to_b2,
-                dst_path,
-                f"{base_name}.dst",
-            )
+    # Validate here so valid files start downloading right away (by the URL's
+    # path, so signed or query-string URLs pass)
+    original_filename = filename_from_url(pes_input.url)
+    if not original_filename.lower().endswith(".pes"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"URL must point to a .pes file: {pes_input.url}"
         )
     
-    upload_tasks.append(
-        loop.run_in_executor(
-            executor,
-            upload_image_to_b2,
-            png_path,
-            f"{base_name}.png",
+    async with _batch_semaphore:
+        # Download PES file
+        tmp_pes_path = await download_from_url(pes_input.url, directory=batch_dir)
+        
+        base_name = original_filename.rsplit(".", 1)[0]
+        
+        # Process in the process pool (CPU-bound): one job per file decodes it
+        # once, then writes the DST and renders the preview. Other files of
+        # the batch keep the remaining workers busy.
+        dst_path = make_temp_path(".dst", directory=batch_dir) if include_dst else None
+        png_path = make_temp_path(".png", directory=batch_dir)
+        dst_path, png_path, stitch_count = await loop.run_in_executor(
+            get_executor(), convert_pes_sync, tmp_pes_path, dst_path, png_path
         )
-    )
-    
-    # Wait for uploads
-    upload_results = await asyncio.gather(*upload_tasks)
-    
-    if include_dst:
-        dst_url = upload_results[0]
-        info_image_url = upload_results[1]
-        uploaded_urls.extend([dst_url, info_image_url])
-    else:
-        dst_url = None
-        info_image_url = upload_results[0]
-        uploaded_urls.append(info_image_url)
-    
-    result = FileOutput(
-        item_id=pes_input.item_id,
-        side=pes_input.side,
-        dst_url=dst_url,
-        info_image_url=info_image_url,
-        metadata={"stitch_count": stitch_count}
-    )
-    
-    return result, temp_files, uploaded_urls
+        
+        return ConvertedFile(
+            pes_input=pes_input,
+            base_name=base_name,
+            dst_path=dst_path,
+            png_path=png_path,
+            stitch_count=stitch_count,
+        )
+
+
+async def upload_with_limit(upload, file_path: str, filename: str) -> str:
+    """Run one B2 upload, keeping at most B2_UPLOAD_CONCURRENCY in flight"""
+    async with _upload_semaphore:
+        return await upload(file_path, filename)
 
 
 @router.post("/convert-pes-to-dst", response_model=BatchConvertResponse)
@@ -182,66 +153,95 @@ async def convert_pes_to_dst(request: BatchConvertRequest):
     """
     Batch convert PES files to DST and generate info images (PARALLEL)
     
-    If any file fails, all uploaded files will be deleted (rollback).
+    All files are converted first, then every output is uploaded in one
+    bounded round. If any file fails, all uploaded files will be deleted (rollback).
     """
-    all_temp_files = []
     all_uploaded_urls = []  # Track all uploaded URLs for rollback
     
+    # One scratch directory per batch, removed in a single pass at the end
+    batch_dir = make_temp_dir("batch-")
+    
     try:
-        # Validate URLs
-        for pes_input in request.urls:
-            if not pes_input.url.lower().endswith(".pes"):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"URL must point to a .pes file: {pes_input.url}"
-                )
-        
         loop = asyncio.get_event_loop()
         
         # Process all files in parallel
         tasks = [
-            process_single_pes(pes_input, request.include_dst, loop)
+            process_single_pes(pes_input, request.include_dst, batch_dir, loop)
             for pes_input in request.urls
         ]
         
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
-        # Collect results, temp files, and uploaded URLs
-        file_outputs = []
+        # Collect converted files
+        converted_files = []
         has_error = False
         error_message = None
+        error_status = 500
         
         for result in results:
             if isinstance(result, Exception):
                 has_error = True
                 error_message = str(result)
+                # Keep client errors (e.g. invalid URL) as they were raised
+                error_status = result.status_code if isinstance(result, HTTPException) else 500
             else:
-                file_output, temp_files, uploaded_urls = result
-                file_outputs.append(file_output)
-                all_temp_files.extend(temp_files)
-                all_uploaded_urls.extend(uploaded_urls)
+                converted_files.append(result)
         
-        # If any error, rollback all uploaded files
+        # If any conversion failed, nothing has been uploaded yet
         if has_error:
-            # Delete all uploaded files
-            delete_multiple_from_b2(all_uploaded_urls)
             raise HTTPException(
-                status_code=500,
+                status_code=error_status,
                 detail=f"Error processing file: {error_message}. All uploaded files have been rolled back."
             )
         
+        # Upload all outputs of the batch together
+        upload_tasks = []
+        for converted in converted_files:
+            if converted.dst_path:
+                upload_tasks.append(
+                    upload_with_limit(upload_dst_to_b2, converted.dst_path, f"{converted.base_name}.dst")
+                )
+            upload_tasks.append(
+                upload_with_limit(upload_image_to_b2, converted.png_path, f"{converted.base_name}.png")
+            )
+        
+        upload_results = await asyncio.gather(*upload_tasks, return_exceptions=True)
+        
+        upload_errors = [r for r in upload_results if isinstance(r, Exception)]
+        all_uploaded_urls.extend(r for r in upload_results if not isinstance(r, Exception))
+        
+        # If any upload failed, rollback all uploaded files
+        if upload_errors:
+            await delete_multiple_from_b2(all_uploaded_urls)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error uploading file: {upload_errors[0]}. All uploaded files have been rolled back."
+            )
+        
+        # Upload results are in the same order the tasks were queued
+        urls = iter(upload_results)
+        file_outputs = []
+        for converted in converted_files:
+            dst_url = next(urls) if converted.dst_path else None
+            file_outputs.append(FileOutput(
+                item_id=converted.pes_input.item_id,
+                side=converted.pes_input.side,
+                dst_url=dst_url,
+                info_image_url=next(urls),
+                metadata={"stitch_count": converted.stitch_count}
+            ))
+        
         return BatchConvertResponse(files=file_outputs)
     
     except HTTPException:
         raise
     except Exception as e:
         # Rollback on unexpected error
-        delete_multiple_from_b2(all_uploaded_urls)
+        await delete_multiple_from_b2(all_uploaded_urls)
         raise HTTPException(
             status_code=500,
             detail=f"Unexpected error: {str(e)}. All uploaded files have been rolled back."
         )
     finally:
         # Cleanup all temp files
-        for tmp_file in all_temp_files:
-            cleanup_temp_file(tmp_file)
+        await asyncio.to_thread(shutil.rmtree, batch_dir, ignore_errors=True)
@@ -1,27 +1,38 @@
 """Convert PES to JSON endpoint"""
 
-import sys
-from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
-sys.path.insert(0, str(Path(__file__).parent.parent))
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import orjson
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile, Form, Header, HTTPException
+from fastapi.responses import Response
 
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-
-from services.file_handler import handle_file_or_url, cleanup_temp_file
-from services.pes_converter import process_pes_to_json_fast, process_pes_to_json_no_preview
+from config import B2_PREVIEW_PATH
+from services.file_handler import (
+    handle_file_or_url,
+    cleanup_temp_file,
+    filename_from_url,
+    hash_hint,
+)
+from services.pes_converter import (
+    process_pes_to_json_fast,
+    process_pes_to_json_no_preview,
+    process_pes_to_json_preview_file,
+    lookup_pes_data,
+)
+from services.b2_storage import upload_image_to_b2, find_in_b2
 
 router = APIRouter()
 
 
 @router.post("/convert")
 async def convert_pes_to_json(
+    background_tasks: BackgroundTasks,
     file: Optional[UploadFile] = File(None),
     url: Optional[str] = Form(None),
     include_preview: bool = Form(True),
     preview_size: int = Form(400),
+    preview_format: Literal["base64", "url", "none"] = Form("base64"),
+    x_content_hash: Optional[str] = Header(None),
 ):
     """
     Convert PES file to JSON format - supports both file upload and URL
@@ -35,28 +46,67 @@ async def convert_pes_to_json(
     - url: URL to PES file (optional, e.g., from B2, S3)
     - include_preview: set false to skip preview generation (faster)
     - preview_size: smaller = faster (default 400px)
+    - preview_format: 'base64' embeds the PNG, 'url' uploads it to B2 and
+      returns its URL, 'none' skips it
+    - X-Content-Hash header or ?hash= in the url: hash8 of the file, lets a
+      file converted before be answered without downloading it (no preview)
     
-    Returns JSON with file info, colors, needle assignments, and optional base64 preview
+    Returns JSON with file info, colors, needle assignments, and optional preview
     """
     tmp_path = None
+    png_path = None
     
     try:
+        # Files converted before can be answered from the client's hash alone
+        if url and not file and (not include_preview or preview_format == "none"):
+            filename = filename_from_url(url)
+            if not filename.lower().endswith(".pes"):
+                raise HTTPException(
+                    status_code=400,
+                    detail="URL must point to a .pes file"
+                )
+            result = lookup_pes_data(hash_hint(url, x_content_hash), url)
+            if result is not None:
+                result["file_info"]["filename"] = filename
+                return Response(content=orjson.dumps(result), media_type="application/json")
+        
         # Handle file or URL
-        tmp_path, filename, filepath = await handle_file_or_url(
-            file, url, required_extension=".pes"
+        tmp_path, filename, filepath, file_hash8 = await handle_file_or_url(
+            file, url, required_extension=".pes", want_hash=True
         )
         
         # Process PES file
-        if include_preview:
-            result = process_pes_to_json_fast(tmp_path, preview_size=preview_size)
+        if not include_preview or preview_format == "none":
+            result = await process_pes_to_json_no_preview(tmp_path, precomputed_hash8=file_hash8)
+        elif preview_format == "url":
+            # Previews are named by content hash, so one already in B2 is reused
+            preview_name = f"{file_hash8}_{preview_size}.png"
+            preview_url = await find_in_b2(preview_name, B2_PREVIEW_PATH)
+            if preview_url is None:
+                result, png_path = await process_pes_to_json_preview_file(
+                    tmp_path, preview_size=preview_size, precomputed_hash8=file_hash8
+                )
+                preview_url = await upload_image_to_b2(png_path, preview_name, folder=B2_PREVIEW_PATH)
+            else:
+                result = await process_pes_to_json_no_preview(tmp_path, precomputed_hash8=file_hash8)
+            result["preview"] = {"url": preview_url, "format": "png"}
         else:
-            result = process_pes_to_json_no_preview(tmp_path)
+            result = await process_pes_to_json_fast(
+                tmp_path, preview_size=preview_size, precomputed_hash8=file_hash8
+            )
         
         # Update file info
         result["file_info"]["filename"] = filename
         result["file_info"]["filepath"] = filepath
         
-        return JSONResponse(content=result)
+        # orjson writes the (base64-heavy) payload much faster than json.dumps
+        response = Response(content=orjson.dumps(result), media_type="application/json")
+        
+        # Temp files are removed once the response is sent
+        background_tasks.add_task(cleanup_temp_file, tmp_path)
+        background_tasks.add_task(cleanup_temp_file, png_path)
+        tmp_path = png_path = None
+        return response
     
     except HTTPException:
         raise
@@ -67,3 +117,4 @@ async def convert_pes_to_json(
         )
     finally:
         cleanup_temp_file(tmp_path)
+        cleanup_temp_file(png_path)
@@ -1,18 +1,23 @@
 """Convert PES to JSON and upload to B2 endpoint"""
 
-import sys
-from pathlib import Path
 from typing import Optional
 
-sys.path.insert(0, str(Path(__file__).parent.parent))
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Header, HTTPException
 from pydantic import BaseModel
 
-from services.file_handler import download_from_url, cleanup_temp_file
-from services.pes_converter import process_pes_to_json_fast, process_pes_to_json_no_preview
-from services.b2_storage import upload_json_to_b2, extract_filename_from_url
+from services.file_handler import (
+    download_from_url,
+    cleanup_temp_file,
+    new_hash8,
+    hash_hint,
+    filename_from_url,
+)
+from services.pes_converter import (
+    process_pes_to_json_fast,
+    process_pes_to_json_no_preview,
+    lookup_pes_data,
+)
+from services.b2_storage import upload_json_to_b2
 
 router = APIRouter()
 
@@ -28,7 +33,11 @@ class ConvertB2Response(BaseModel):
 
 
 @router.post("/convert-pes-to-json", response_model=ConvertB2Response)
-async def convert_pes_to_json_b2(request: ConvertB2Request):
+async def convert_pes_to_json_b2(
+    request: ConvertB2Request,
+    background_tasks: BackgroundTasks,
+    x_content_hash: Optional[str] = Header(None),
+):
     """
     Convert PES file from URL to JSON and upload to B2
     
@@ -47,24 +56,34 @@ async def convert_pes_to_json_b2(request: ConvertB2Request):
     tmp_path = None
     
     try:
+        # Extract filename (URL path only, so a ?hash= hint is not part of it)
+        original_filename = filename_from_url(request.url)
+        
         # Validate URL
-        if not request.url.lower().endswith(".pes"):
+        if not original_filename.lower().endswith(".pes"):
             raise HTTPException(
                 status_code=400,
                 detail="URL must point to a .pes file"
             )
         
-        # Download PES file
-        tmp_path = await download_from_url(request.url)
-        
-        # Extract filename
-        original_filename = extract_filename_from_url(request.url)
+        # Files converted before can be answered from the client's hash alone
+        result = None
+        if not request.include_preview:
+            result = lookup_pes_data(hash_hint(request.url, x_content_hash), request.url)
         
-        # Process PES file
-        if request.include_preview:
-            result = process_pes_to_json_fast(tmp_path, preview_size=request.preview_size)
-        else:
-            result = process_pes_to_json_no_preview(tmp_path)
+        if result is None:
+            # Download PES file, hashing it on the way
+            hasher = new_hash8()
+            tmp_path = await download_from_url(request.url, hasher=hasher)
+            file_hash8 = hasher.hexdigest()[:8]
+            
+            # Process PES file
+            if request.include_preview:
+                result = await process_pes_to_json_fast(
+                    tmp_path, preview_size=request.preview_size, precomputed_hash8=file_hash8
+                )
+            else:
+                result = await process_pes_to_json_no_preview(tmp_path, precomputed_hash8=file_hash8)
         
         # Update file info
         result["file_info"]["filename"] = original_filename
@@ -72,8 +91,11 @@ async def convert_pes_to_json_b2(request: ConvertB2Request):
         
         # Upload to B2
         json_filename = original_filename.rsplit(".", 1)[0] + ".json"
-        json_url = upload_json_to_b2(result, json_filename)
+        json_url = await upload_json_to_b2(result, json_filename)
         
+        # The temp file is removed once the response is sent
+        background_tasks.add_task(cleanup_temp_file, tmp_path)
+        tmp_path = None
         return ConvertB2Response(url=json_url)
     
     except HTTPException:
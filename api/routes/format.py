@@ -1,24 +1,39 @@
 """Convert embroidery format endpoint"""
 
+import asyncio
+import io
 import os
-import sys
-import tempfile
-from pathlib import Path
 from typing import Optional
 
-sys.path.insert(0, str(Path(__file__).parent.parent))
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import Response
-from pyembroidery import read, write as write_embroidery
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+from pyembroidery import EmbPattern, read, write as write_embroidery
 
-from config import SUPPORTED_FORMATS
-from services.file_handler import handle_file_or_url, cleanup_temp_file
+from config import SUPPORTED_FORMATS, MAX_FILE_SIZE
+from services.file_handler import (
+    handle_file_or_url,
+    cleanup_temp_file,
+    make_temp_path,
+)
 
 router = APIRouter()
 
 
+def _read_upload(file: UploadFile):
+    """Decode an upload straight from its spooled buffer, without a temp file"""
+    extension = os.path.splitext(file.filename)[1].lower().lstrip(".")
+    for file_type in EmbPattern.supported_formats():
+        if file_type["extension"] != extension:
+            continue
+        reader = file_type.get("reader")
+        stream = file.file
+        if getattr(reader, "READ_FILE_IN_TEXT_MODE", False):
+            stream = io.TextIOWrapper(stream)
+        return EmbPattern.read_embroidery(reader, stream)
+    return None
+
+
 @router.post("/convert-format")
 async def convert_embroidery_format(
     file: Optional[UploadFile] = File(None),
@@ -40,53 +55,55 @@ async def convert_embroidery_format(
     Example: Convert PES to DST
     """
     # Normalize output format
-    output_format = output_format.lower().strip()
-    if not output_format.startswith('.'):
-        output_format = f'.{output_format}'
+    output_format = "." + output_format.lower().strip().lstrip(".")
     
     # Validate format
     if output_format not in SUPPORTED_FORMATS:
         raise HTTPException(
             status_code=400,
-            detail=f"Unsupported format. Supported: {', '.join(SUPPORTED_FORMATS)}"
+            detail=f"Unsupported format. Supported: {', '.join(sorted(SUPPORTED_FORMATS))}"
         )
     
     tmp_input_path = None
     tmp_output_path = None
     
     try:
-        # Handle file or URL (no extension requirement)
-        tmp_input_path, original_filename, filepath = await handle_file_or_url(
-            file, url, required_extension=None
-        )
+        if file and not url:
+            # Read upload in memory (spooled to disk only when large)
+            original_filename = file.filename
+            if file.size is not None and file.size > MAX_FILE_SIZE:
+                raise HTTPException(status_code=413, detail="File too large")
+            await file.seek(0)
+            pattern = await asyncio.to_thread(_read_upload, file)
+        else:
+            # Handle URL (no extension requirement)
+            tmp_input_path, original_filename, filepath, _ = await handle_file_or_url(
+                file, url, required_extension=None
+            )
+            pattern = await asyncio.to_thread(read, tmp_input_path)
         
-        # Read embroidery pattern
-        pattern = read(tmp_input_path)
         if pattern is None:
             raise ValueError("Unable to read embroidery file")
         
-        # Create output file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=output_format) as tmp_out:
-            tmp_output_path = tmp_out.name
-        
-        # Convert format
-        write_embroidery(pattern, tmp_output_path)
+        # Pick output file path
+        tmp_output_path = make_temp_path(output_format)
         
-        # Read converted file
-        with open(tmp_output_path, 'rb') as f:
-            output_data = f.read()
+        # Convert format (off the event loop, large files take a while)
+        await asyncio.to_thread(write_embroidery, pattern, tmp_output_path)
         
         # Generate output filename
         base_name = os.path.splitext(original_filename)[0]
         output_filename = f"{base_name}{output_format}"
         
-        return Response(
-            content=output_data,
+        # Send the file as is; it is removed once the response is sent
+        response = FileResponse(
+            tmp_output_path,
             media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f'attachment; filename="{output_filename}"'
-            }
+            filename=output_filename,
+            background=BackgroundTask(cleanup_temp_file, tmp_output_path),
         )
+        tmp_output_path = None
+        return response
     
     except HTTPException:
         raise
@@ -1,13 +1,9 @@
 """Generate preview endpoint"""
 
-import sys
-from pathlib import Path
+import asyncio
 from typing import Optional
 
-sys.path.insert(0, str(Path(__file__).parent.parent))
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile, Form, HTTPException
 from fastapi.responses import Response
 
 from services.file_handler import handle_file_or_url, cleanup_temp_file
@@ -18,6 +14,7 @@ router = APIRouter()
 
 @router.post("/preview")
 async def generate_preview(
+    background_tasks: BackgroundTasks,
     file: Optional[UploadFile] = File(None),
     url: Optional[str] = Form(None),
     max_size: int = Form(800),
@@ -42,13 +39,16 @@ async def generate_preview(
     
     try:
         # Handle file or URL
-        tmp_path, filename, filepath = await handle_file_or_url(
+        tmp_path, filename, filepath, _ = await handle_file_or_url(
             file, url, required_extension=".pes"
         )
         
-        # Generate preview
-        png_data = generate_pes_preview(tmp_path, max_size, linewidth)
+        # Generate preview in memory (off the event loop)
+        png_data = await asyncio.to_thread(generate_pes_preview, tmp_path, max_size, linewidth)
         
+        # The temp file is removed once the response is sent
+        background_tasks.add_task(cleanup_temp_file, tmp_path)
+        tmp_path = None
         return Response(content=png_data, media_type="image/png")
     
     except HTTPException:
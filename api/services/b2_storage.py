@@ -1,13 +1,12 @@
 """Backblaze B2 Storage Service"""
 
-import sys
-from pathlib import Path
+from contextlib import AsyncExitStack
+from typing import Optional
 
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
-import json
-import boto3
+import aioboto3
+import orjson
 from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 from config import (
     B2_ACCESS_KEY_ID,
@@ -15,25 +14,58 @@ from config import (
     B2_DEFAULT_REGION,
     B2_BUCKET,
     B2_ENDPOINT,
+    B2_MAX_POOL_CONNECTIONS,
+    B2_MAX_ATTEMPTS,
+    B2_DELETE_BATCH_SIZE,
     B2_JSON_OUTPUT_PATH,
     B2_DST_OUTPUT_PATH,
     B2_INFO_IMAGE_PATH,
 )
 
 
-def get_b2_client():
-    """Create B2 S3-compatible client"""
-    return boto3.client(
-        "s3",
-        endpoint_url=B2_ENDPOINT,
-        aws_access_key_id=B2_ACCESS_KEY_ID,
-        aws_secret_access_key=B2_SECRET_ACCESS_KEY,
-        region_name=B2_DEFAULT_REGION,
-        config=Config(signature_version="s3v4"),
-    )
-
-
-def upload_json_to_b2(data: dict, filename: str) -> str:
+_session = aioboto3.Session()
+_client = None
+_client_stack: Optional[AsyncExitStack] = None
+
+
+async def open_b2_client():
+    """Open the shared B2 S3-compatible client (called on app startup)"""
+    global _client, _client_stack
+    if _client is None:
+        stack = AsyncExitStack()
+        _client = await stack.enter_async_context(
+            _session.client(
+                "s3",
+                endpoint_url=B2_ENDPOINT,
+                aws_access_key_id=B2_ACCESS_KEY_ID,
+                aws_secret_access_key=B2_SECRET_ACCESS_KEY,
+                region_name=B2_DEFAULT_REGION,
+                config=Config(
+                    signature_version="s3v4",
+                    max_pool_connections=B2_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": B2_MAX_ATTEMPTS},
+                ),
+            )
+        )
+        _client_stack = stack
+    return _client
+
+
+async def close_b2_client() -> None:
+    """Close the shared B2 client (called on app shutdown)"""
+    global _client, _client_stack
+    if _client_stack is not None:
+        await _client_stack.aclose()
+    _client = None
+    _client_stack = None
+
+
+async def get_b2_client():
+    """Get the shared B2 S3-compatible client, opening it on first use"""
+    return await open_b2_client()
+
+
+async def upload_json_to_b2(data: dict, filename: str) -> str:
     """
     Upload JSON data to B2
     
@@ -44,7 +76,7 @@ def upload_json_to_b2(data: dict, filename: str) -> str:
     Returns:
         Full URL to uploaded file
     """
-    client = get_b2_client()
+    client = await get_b2_client()
     
     # Ensure filename ends with .json
     if not filename.endswith(".json"):
@@ -53,14 +85,14 @@ def upload_json_to_b2(data: dict, filename: str) -> str:
     # Build key path
     key = f"{B2_JSON_OUTPUT_PATH}/{filename}"
     
-    # Convert to JSON string
-    json_content = json.dumps(data, indent=2, ensure_ascii=False)
+    # Serialize compactly (already UTF-8 bytes)
+    json_content = orjson.dumps(data)
     
     # Upload to B2
-    client.put_object(
+    await client.put_object(
         Bucket=B2_BUCKET,
         Key=key,
-        Body=json_content.encode("utf-8"),
+        Body=json_content,
         ContentType="application/json",
     )
     
@@ -68,12 +100,7 @@ def upload_json_to_b2(data: dict, filename: str) -> str:
     return f"{B2_ENDPOINT}/{B2_BUCKET}/{key}"
 
 
-def extract_filename_from_url(url: str) -> str:
-    """Extract filename from URL"""
-    return url.split("/")[-1]
-
-
-def upload_dst_to_b2(file_path: str, filename: str) -> str:
+async def upload_dst_to_b2(file_path: str, filename: str) -> str:
     """
     Upload DST file to B2
     
@@ -84,7 +111,7 @@ def upload_dst_to_b2(file_path: str, filename: str) -> str:
     Returns:
         Full URL to uploaded file
     """
-    client = get_b2_client()
+    client = await get_b2_client()
     
     # Ensure filename ends with .dst
     if not filename.endswith(".dst"):
@@ -93,59 +120,84 @@ def upload_dst_to_b2(file_path: str, filename: str) -> str:
     # Build key path
     key = f"{B2_DST_OUTPUT_PATH}/{filename}"
     
-    # Read file content
+    # Upload to B2, streaming the body straight from the file
     with open(file_path, "rb") as f:
-        content = f.read()
-    
-    # Upload to B2
-    client.put_object(
-        Bucket=B2_BUCKET,
-        Key=key,
-        Body=content,
-        ContentType="application/octet-stream",
-    )
+        await client.put_object(
+            Bucket=B2_BUCKET,
+            Key=key,
+            Body=f,
+            ContentType="application/octet-stream",
+        )
     
     # Return full URL
     return f"{B2_ENDPOINT}/{B2_BUCKET}/{key}"
 
 
-def upload_image_to_b2(file_path: str, filename: str) -> str:
+async def upload_image_to_b2(file_path: str, filename: str, folder: str = B2_INFO_IMAGE_PATH) -> str:
     """
     Upload PNG image to B2
     
     Args:
         file_path: Local path to PNG file
         filename: Output filename (without path)
+        folder: Key prefix to upload under (defaults to info images)
     
     Returns:
         Full URL to uploaded file
     """
-    client = get_b2_client()
+    client = await get_b2_client()
     
     # Ensure filename ends with .png
     if not filename.endswith(".png"):
         filename = filename.rsplit(".", 1)[0] + ".png"
     
     # Build key path
-    key = f"{B2_INFO_IMAGE_PATH}/{filename}"
+    key = f"{folder}/{filename}"
     
-    # Read file content
+    # Upload to B2, streaming the body straight from the file
     with open(file_path, "rb") as f:
-        content = f.read()
-    
-    # Upload to B2
-    client.put_object(
-        Bucket=B2_BUCKET,
-        Key=key,
-        Body=content,
-        ContentType="image/png",
-    )
+        await client.put_object(
+            Bucket=B2_BUCKET,
+            Key=key,
+            Body=f,
+            ContentType="image/png",
+        )
     
     # Return full URL
     return f"{B2_ENDPOINT}/{B2_BUCKET}/{key}"
 
 
-def delete_from_b2(url: str) -> bool:
+async def find_in_b2(filename: str, folder: str) -> Optional[str]:
+    """
+    Return the URL of an object already in B2, or None if it is not there
+    
+    Lets content-addressed uploads (e.g. previews named by hash8) be skipped.
+    Any lookup error counts as missing, so the caller just uploads again.
+    """
+    client = await get_b2_client()
+    key = f"{folder}/{filename}"
+    try:
+        await client.head_object(Bucket=B2_BUCKET, Key=key)
+    except (ClientError, BotoCoreError):
+        return None
+    return f"{B2_ENDPOINT}/{B2_BUCKET}/{key}"
+
+
+def extract_key_from_url(url: str) -> Optional[str]:
+    """Extract the B2 object key from a URL, or None if it is not in the bucket"""
+    # URL format: https://s3.../Bucket/path/to/file
+    prefix = f"{B2_ENDPOINT}/{B2_BUCKET}/"
+    if url.startswith(prefix):
+        return url[len(prefix):]
+    
+    # Try to extract from any URL format
+    parts = url.split(f"{B2_BUCKET}/")
+    if len(parts) > 1:
+        return parts[1]
+    return None
+
+
+async def delete_from_b2(url: str) -> bool:
     """
     Delete file from B2 by URL
     
@@ -156,34 +208,48 @@ def delete_from_b2(url: str) -> bool:
         True if deleted successfully
     """
     try:
-        client = get_b2_client()
+        key = extract_key_from_url(url)
+        if key is None:
+            return False
         
-        # Extract key from URL
-        # URL format: https://s3.../Bucket/path/to/file
-        prefix = f"{B2_ENDPOINT}/{B2_BUCKET}/"
-        if url.startswith(prefix):
-            key = url[len(prefix):]
-        else:
-            # Try to extract from any URL format
-            parts = url.split(f"{B2_BUCKET}/")
-            if len(parts) > 1:
-                key = parts[1]
-            else:
-                return False
-        
-        client.delete_object(Bucket=B2_BUCKET, Key=key)
+        client = await get_b2_client()
+        await client.delete_object(Bucket=B2_BUCKET, Key=key)
         return True
     except Exception:
         return False
 
 
-def delete_multiple_from_b2(urls: list) -> None:
+async def delete_multiple_from_b2(urls: list) -> None:
     """
-    Delete multiple files from B2
+    Delete multiple files from B2 using batched delete_objects calls
     
     Args:
         urls: List of URLs to delete
     """
-    for url in urls:
-        if url:
-            delete_from_b2(url)
+    keys = [key for key in (extract_key_from_url(url) for url in urls if url) if key]
+    if not keys:
+        return
+    
+    try:
+        client = await get_b2_client()
+    except Exception:
+        return
+    
+    for start in range(0, len(keys), B2_DELETE_BATCH_SIZE):
+        chunk = keys[start:start + B2_DELETE_BATCH_SIZE]
+        # Best effort per chunk: one failed call must not skip the rest
+        try:
+            response = await client.delete_objects(
+                Bucket=B2_BUCKET,
+                Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+            )
+            failed = [error["Key"] for error in response.get("Errors", []) if "Key" in error]
+        except Exception:
+            failed = chunk
+        
+        # Retry what the batch call did not delete one key at a time
+        for key in failed:
+            try:
+                await client.delete_object(Bucket=B2_BUCKET, Key=key)
+            except Exception:
+                pass
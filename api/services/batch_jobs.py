@@ -0,0 +1,45 @@
+"""Process pool jobs for batch conversion
+
+Kept free of app imports (config, file handling, clients): the job needs
+none of them, so all paths are chosen by the caller.
+"""
+
+from pathlib import Path
+from typing import Optional, Tuple
+
+from pyembroidery import read, write as write_embroidery
+
+from render_pes_trueview import render_pattern
+
+
+def convert_pes_sync(pes_path: str, dst_path: Optional[str], png_path: str) -> Tuple[Optional[str], str, int]:
+    """
+    Decode a PES file once, write its DST (if dst_path is given) and render its preview
+    
+    Args:
+        pes_path: Downloaded PES file
+        dst_path: Where to write the DST, or None to skip it
+        png_path: Where to write the preview PNG
+    
+    Returns:
+        (dst_path, png_path, stitch_count)
+    """
+    pattern = read(pes_path)
+    if pattern is None:
+        raise ValueError(f"Unable to read PES file")
+    
+    if dst_path:
+        write_embroidery(pattern, dst_path)
+    
+    render_pattern(
+        pattern,
+        png_path=Path(png_path),
+        background=None,
+        linewidth=1,  # Thinner = faster
+        margin=0,
+        max_size=400,  # Smaller for speed
+        native_size=True,
+        output_base64=False,
+    )
+    
+    return dst_path, png_path, pattern.count_stitches()
@@ -1,34 +1,107 @@
 """File and URL handling service"""
 
+import asyncio
+import atexit
+import hashlib
 import os
-import sys
+import re
+import shutil
 import tempfile
-from pathlib import Path
+import threading
 from typing import Tuple, Optional
-
-sys.path.insert(0, str(Path(__file__).parent.parent))
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
 
 import httpx
 from fastapi import UploadFile, HTTPException
+from fastapi.responses import JSONResponse
+
+from config import (
+    DOWNLOAD_CHUNK_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    MAX_FILE_SIZE,
+    SCRATCH_DIR,
+    MAX_CONCURRENT_DOWNLOADS,
+)
+from services.http_client import get_http_client
+
+# Per-worker scratch directory (on tmpfs when SCRATCH_DIR is set); every temp
+# file of a request lives here and the whole directory is removed at exit.
+# Created on first use, not at import: the batch pool's forkserver imports
+# the app too and never runs atexit, so it must not create one.
+_workdir: Optional[str] = None
+_workdir_lock = threading.Lock()
+
+# Content hash a client may send along with a URL (hash8 or a longer sha256 prefix)
+_HASH_HINT = re.compile(r"[0-9a-f]{8,64}")
+
+# Caps URL downloads in flight across all requests
+_download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+
+def get_workdir() -> str:
+    """Return this process's scratch directory, creating it on first use"""
+    global _workdir
+    if _workdir is None:
+        with _workdir_lock:
+            if _workdir is None:
+                workdir = tempfile.mkdtemp(prefix="pesapi-", dir=SCRATCH_DIR)
+                atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+                _workdir = workdir
+    return _workdir
 
-from config import DOWNLOAD_TIMEOUT
 
+def make_temp_path(suffix: str = "", directory: Optional[str] = None) -> str:
+    """Return a new unique file path inside directory or the workdir (the file is not created)"""
+    return os.path.join(directory or get_workdir(), f"{uuid4().hex}{suffix}")
 
-async def download_from_url(url: str) -> str:
+
+def make_temp_dir(prefix: str = "") -> str:
+    """Create a new scratch directory inside the workdir and return its path"""
+    return tempfile.mkdtemp(prefix=prefix, dir=get_workdir())
+
+
+def filename_from_url(url: str) -> str:
+    """Last path segment of a URL, without query string or fragment"""
+    return urlparse(url).path.rsplit("/", 1)[-1]
+
+
+def hash_hint(url: Optional[str], header: Optional[str] = None) -> Optional[str]:
     """
-    Download file from URL to temp file
-    
-    Args:
-        url: URL to download
+    Client-supplied hash8 of the file behind a URL, if any
     
-    Returns:
-        Path to temp file
+    Taken from the X-Content-Hash header or the URL's ?hash= parameter.
+    Returns None unless the value looks like a sha256 hex prefix.
     """
+    candidates = [header] if header else []
+    if url:
+        candidates += parse_qs(urlparse(url).query).get("hash", [])
+    for value in candidates:
+        value = value.strip().lower()
+        if _HASH_HINT.fullmatch(value):
+            return value[:8]
+    return None
+
+
+def new_hash8():
+    """Return a hasher matching compute_hash8 (first 8 hex chars of its sha256)"""
+    return hashlib.sha256()
+
+
+def _write_chunk(tmp, chunk: bytes, hasher=None) -> None:
+    tmp.write(chunk)
+    if hasher is not None:
+        hasher.update(chunk)
+
+
+async def _stream_to_file(url: str, tmp, hasher=None) -> None:
+    """Stream a URL's body into an open binary file chunk by chunk (writes run in a thread)"""
+    client = get_http_client()
     try:
-        async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT) as client:
-            response = await client.get(url)
+        async with _download_semaphore, client.stream("GET", url) as response:
             response.raise_for_status()
-            content = response.content
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(_write_chunk, tmp, chunk, hasher)
     except httpx.HTTPStatusError as e:
         raise HTTPException(
             status_code=e.response.status_code,
@@ -39,22 +112,79 @@ async def download_from_url(url: str) -> str:
             status_code=400,
             detail=f"Invalid URL or network error: {e}"
         )
+
+
+async def download_from_url(url: str, directory: Optional[str] = None, hasher=None) -> str:
+    """
+    Download file from URL to temp file
     
+    Args:
+        url: URL to download
+        directory: Directory for the temp file (defaults to the workdir)
+        hasher: Optional hashlib object fed with the body as it is written
+    
+    Returns:
+        Path to temp file
+    """
     # Get file extension from URL
-    filename = url.split("/")[-1]
-    file_ext = os.path.splitext(filename)[1]
+    file_ext = os.path.splitext(filename_from_url(url))[1]
+    
+    # Stream to temp file, removing it if the download fails
+    tmp = open(make_temp_path(file_ext, directory), "wb")
+    try:
+        with tmp:
+            await _stream_to_file(url, tmp, hasher)
+    except BaseException:
+        cleanup_temp_file(tmp.name)
+        raise
+    return tmp.name
+
+
+class ContentLengthLimitMiddleware:
+    """
+    Reject requests whose Content-Length exceeds MAX_FILE_SIZE
+    
+    Runs as ASGI middleware, i.e. before FastAPI parses the multipart form,
+    so an oversized upload is answered with 413 without reading its body.
+    Uploads without Content-Length are capped while copying (_save_upload).
+    """
+    
+    def __init__(self, app):
+        self.app = app
     
-    # Save to temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-        tmp.write(content)
-        return tmp.name
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            content_length = dict(scope["headers"]).get(b"content-length", b"")
+            if content_length.isdigit() and int(content_length) > MAX_FILE_SIZE:
+                response = JSONResponse({"detail": "File too large"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def _save_upload(file: UploadFile, suffix: str, hasher=None) -> str:
+    """Copy an uploaded file to a temp file in fixed-size chunks, up to MAX_FILE_SIZE"""
+    tmp_path = make_temp_path(suffix)
+    try:
+        with open(tmp_path, "wb") as tmp:
+            written = 0
+            while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail="File too large")
+                _write_chunk(tmp, chunk, hasher)
+    except BaseException:
+        cleanup_temp_file(tmp_path)
+        raise
+    return tmp_path
 
 
 async def handle_file_or_url(
     file: Optional[UploadFile],
     url: Optional[str],
     required_extension: Optional[str] = None,
-) -> Tuple[str, str, str]:
+    want_hash: bool = False,
+) -> Tuple[str, str, str, Optional[str]]:
     """
     Handle file upload or URL download
     
@@ -62,9 +192,11 @@ async def handle_file_or_url(
         file: Uploaded file
         url: URL to download
         required_extension: Required file extension (e.g., '.pes')
+        want_hash: Compute the file's hash8 while it is written
     
     Returns:
-        Tuple of (temp_file_path, filename, filepath)
+        Tuple of (temp_file_path, filename, filepath, hash8), hash8 being
+        None unless want_hash is set
     
     Raises:
         HTTPException: If validation fails
@@ -85,6 +217,7 @@ async def handle_file_or_url(
     tmp_path = None
     filename = None
     filepath = None
+    hasher = new_hash8() if want_hash else None
     
     # Handle file upload
     if file:
@@ -98,54 +231,36 @@ async def handle_file_or_url(
                 detail=f"File must be a {required_extension} file"
             )
         
-        # Save to temp file
+        # Stream to temp file off the event loop, then release the spooled
+        # upload instead of holding it until the request ends
         file_ext = os.path.splitext(filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+        await file.seek(0)
+        try:
+            tmp_path = await asyncio.to_thread(_save_upload, file, file_ext, hasher)
+        finally:
+            await file.close()
     
     # Handle URL
     elif url:
-        filename = url.split("/")[-1]
+        filename = filename_from_url(url)
         filepath = url
         
         # Validate extension
-        if required_extension and not url.lower().endswith(required_extension):
+        if required_extension and not filename.lower().endswith(required_extension):
             raise HTTPException(
                 status_code=400,
                 detail=f"URL must point to a {required_extension} file"
             )
         
-        # Download file
-        try:
-            async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT) as client:
-                response = await client.get(url)
-                response.raise_for_status()
-                content = response.content
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=e.response.status_code,
-                detail=f"Failed to download file from URL: {e}",
-            )
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid URL or network error: {e}"
-            )
-        
-        # Save to temp file
-        file_ext = os.path.splitext(filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        # Stream to temp file
+        tmp_path = await download_from_url(url, hasher=hasher)
     
-    return tmp_path, filename, filepath
+    return tmp_path, filename, filepath, hasher.hexdigest()[:8] if hasher else None
 
 
 def cleanup_temp_file(file_path: Optional[str]) -> None:
-    """Safely cleanup temporary file"""
-    if file_path and os.path.exists(file_path):
+    """Safely cleanup temporary file (a missing file is ignored)"""
+    if file_path:
         try:
             os.unlink(file_path)
         except OSError:
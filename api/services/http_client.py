@@ -0,0 +1,32 @@
+"""Shared HTTP client for URL downloads"""
+
+from typing import Optional
+
+import httpx
+
+from config import DOWNLOAD_TIMEOUT, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client, keeping connections alive between downloads"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=DOWNLOAD_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client (called on app shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -2,44 +2,129 @@
 Optimized PES processing utilities for API
 """
 
+import io
 import os
-import sys
-import base64
-import tempfile
+import copy
+import asyncio
 import pathlib
-from pathlib import Path
-from typing import Dict
-
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
 from pyembroidery import read
 from pes_to_json import (
     compute_hash8,
-    load_cache,
-    save_cache,
-    compute_metrics,
-    build_color_blocks,
+    load_cache_entry,
+    save_cache_entry,
+    scan_pattern,
     thread_to_hex,
+    thread_display_code,
     rgb_to_hex,
     assign_colors_to_needles,
+    preview_payload,
 )
-from render_pes_trueview import render_pes
+from render_pes_trueview import render_pes, render_pattern
+from config import PES_DATA_CACHE_SIZE, NEEDLE_CACHE_FLUSH_INTERVAL
+from services.file_handler import make_temp_path
 
+# JSON payloads (without preview) of recently converted files, by hash8
+_pes_data_cache: OrderedDict = OrderedDict()
 
-def process_pes_to_json_fast(pes_path: str, preview_size: int = 400) -> Dict:
-    """
-    Fast PES to JSON conversion with smaller preview
-    """
+# Needle cache entries waiting to be written to disk, by hash8
+_pending_needle_entries: Dict[str, Dict] = {}
+
+
+def _read_pattern(pes_path: str):
+    """Read a PES file, raising if it cannot be decoded"""
     pattern = read(str(pes_path))
     if pattern is None:
         raise ValueError(f"Unable to read PES pattern from {pes_path}")
+    return pattern
+
+
+def _load_needle_entry(file_hash8: str) -> Optional[Dict]:
+    """Needle cache entry of a file hash, including entries not flushed yet"""
+    entry = _pending_needle_entries.get(file_hash8)
+    return entry if entry is not None else load_cache_entry(file_hash8)
+
+
+async def _load_inputs(pes_path: str, file_hash8: str) -> Tuple:
+    """Read the pattern and load its needle cache entry concurrently"""
+    return await asyncio.gather(
+        asyncio.to_thread(_read_pattern, pes_path),
+        asyncio.to_thread(_load_needle_entry, file_hash8),
+    )
 
-    file_hash8 = compute_hash8(pes_path)
-    cache = load_cache()
 
-    # Generate smaller preview for speed
-    preview_data = generate_preview_fast(pes_path, max_size=preview_size)
+def _cached_pes_data(file_hash8: str, pes_path: str) -> Optional[Dict]:
+    """Return a copy of the remembered JSON payload for a file hash, if any"""
+    pes_data = _pes_data_cache.get(file_hash8)
+    if pes_data is None:
+        return None
+    _pes_data_cache.move_to_end(file_hash8)
     
+    pes_data = copy.deepcopy(pes_data)
+    pes_data["file_info"]["filename"] = os.path.basename(pes_path)
+    pes_data["file_info"]["filepath"] = pes_path
+    return pes_data
+
+
+def lookup_pes_data(hint_hash8: Optional[str], pes_path: str) -> Optional[Dict]:
+    """
+    Return the remembered JSON payload for a client-supplied hash8, if any
+    
+    Lets callers answer for a file they already converted without
+    downloading, hashing or parsing it again.
+    """
+    if not hint_hash8:
+        return None
+    return _cached_pes_data(hint_hash8, pes_path)
+
+
+def _queue_needle_entry(file_hash8: str, entry: Dict) -> None:
+    """Schedule a needle cache entry for the next flush instead of writing it now"""
+    _pending_needle_entries[file_hash8] = entry
+
+
+def _save_needle_entries(entries: Dict[str, Dict]) -> None:
+    for file_hash8, entry in entries.items():
+        # Re-converting a known file yields the entry already on disk: skip the rewrite
+        if load_cache_entry(file_hash8) != entry:
+            save_cache_entry(file_hash8, entry)
+
+
+async def flush_needle_cache() -> None:
+    """Write the needle cache entries added since the last flush"""
+    if not _pending_needle_entries:
+        return
+    entries = dict(_pending_needle_entries)
+    await asyncio.to_thread(_save_needle_entries, entries)
+    # Entries stay visible to lookups until they are on disk
+    for file_hash8, entry in entries.items():
+        if _pending_needle_entries.get(file_hash8) is entry:
+            del _pending_needle_entries[file_hash8]
+
+
+async def run_needle_cache_flusher() -> None:
+    """Flush the needle cache every NEEDLE_CACHE_FLUSH_INTERVAL seconds (app lifetime task)"""
+    while True:
+        await asyncio.sleep(NEEDLE_CACHE_FLUSH_INTERVAL)
+        await flush_needle_cache()
+
+
+def _remember_pes_data(file_hash8: str, pes_data: Dict) -> None:
+    """Remember a JSON payload (without preview) for its file hash"""
+    _pes_data_cache[file_hash8] = copy.deepcopy(dict(pes_data, preview=None))
+    _pes_data_cache.move_to_end(file_hash8)
+    while len(_pes_data_cache) > PES_DATA_CACHE_SIZE:
+        _pes_data_cache.popitem(last=False)
+
+
+def build_pes_data(pes_path: str, pattern, file_hash8: str, cached_entry: Optional[Dict]) -> Dict:
+    """
+    Build the JSON payload of a decoded pattern (without preview)
+    and assign needles, reusing cached_entry if given or queueing a new
+    needle cache entry (written by flush_needle_cache)
+    """
     # Get basic file information
     pes_filename = os.path.basename(pes_path)
     stitch_count = pattern.count_stitches()
@@ -52,40 +137,41 @@ def process_pes_to_json_fast(pes_path: str, preview_size: int = 400) -> Dict:
     else:
         width_mm = height_mm = 0
     
-    color_blocks = build_color_blocks(pattern)
+    color_blocks, metrics = scan_pattern(pattern)
     threads = pattern.threadlist or []
     color_count = len({c for c in (thread_to_hex(t) for t in threads) if c})
-    stop_flags = [block.get("stop_funshion", False) for block in color_blocks]
-    metrics = compute_metrics(pattern)
     
-    # Process colors
+    # Process colors in one pass over the blocks (hot loop: attributes read
+    # once, brand check is a set lookup). color_count stays a separate pass:
+    # it covers the whole threadlist, including threads no block uses.
     colors = []
+    append_color = colors.append
     for idx, block in enumerate(color_blocks):
         thread = block.get("thread")
         color_num = idx + 1
-        color_rgb = thread.color if thread else 0
         st_count = block.get("stitch_count", 0)
         
-        code = getattr(thread, "catalog_number", "")
-        color_way = code.split("-")[1] if code and "-" in code else code
-        name = getattr(thread, "description", "")
-        chart = getattr(thread, "brand", "")
+        if thread is not None:
+            color_rgb = thread.color
+            code = thread.catalog_number
+            name = thread.description
+            chart = thread.brand
+        else:
+            color_rgb, code, name, chart = 0, "", "", ""
+        
+        parts = code.split("-") if code and "-" in code else None
+        color_way = parts[1] if parts else code
         
-        display_code = code
-        if chart in ["Metro Pro", "Lemiex"] and "-" in code:
-            parts = code.split("-")
-            if len(parts) == 2:
-                try:
-                    num1, num2 = int(parts[0]), int(parts[1])
-                    display_code = str(min(num1, num2))
-                except ValueError:
-                    pass
+        display_code = thread_display_code(code, chart)
         
-        stop_flag = bool(stop_flags[idx]) if idx < len(stop_flags) else False
+        stop_flag = bool(block.get("stop_funshion", False))
         if stop_flag and name:
             name = f"{name}, Stop"
 
-        colors.append({
+        # Plain dicts on purpose: the constant-key literal is built pre-sized in
+        # one step, assign_colors_to_needles updates them in place, and they
+        # go to the JSON response as is
+        append_color({
             "id": color_num,
             "sequence": color_num,
             "needle_number": None,
@@ -115,7 +201,7 @@ def process_pes_to_json_fast(pes_path: str, preview_size: int = 400) -> Dict:
             "trims": metrics["trims"],
             "appliques": metrics["appliques"],
         },
-        "preview": preview_data,
+        "preview": None,
         "colors": colors,
         "needle_assignment": {
             "assignments": {},
@@ -132,7 +218,6 @@ def process_pes_to_json_fast(pes_path: str, preview_size: int = 400) -> Dict:
     }
     
     # Auto-assign needles
-    cached_entry = cache.get(file_hash8)
     if cached_entry and cached_entry.get("assignments"):
         needle_assignments = cached_entry["assignments"]
         cached_colors = {c.get("sequence"): c.get("needle_number") for c in cached_entry.get("colors", [])}
@@ -141,169 +226,147 @@ def process_pes_to_json_fast(pes_path: str, preview_size: int = 400) -> Dict:
             color["needle_number"] = nn if nn is not None else color.get("needle_number")
     else:
         needle_assignments = assign_colors_to_needles(colors)
-        cache[file_hash8] = {
+        _queue_needle_entry(file_hash8, {
             "assignments": needle_assignments,
             "colors": [{"sequence": c["sequence"], "needle_number": c["needle_number"]} for c in colors],
-        }
-        save_cache(cache)
+        })
     
     pes_data["needle_assignment"]["assignments"] = needle_assignments
     
     return pes_data
 
 
-def process_pes_to_json_no_preview(pes_path: str) -> Dict:
-    """
-    Ultra-fast PES to JSON without preview generation
+async def _process_pes_core(
+    pes_path: str,
+    preview_size: Optional[int],
+    precomputed_hash8: Optional[str],
+    render_preview=None,
+) -> Dict:
     """
-    pattern = read(str(pes_path))
-    if pattern is None:
-        raise ValueError(f"Unable to read PES pattern from {pes_path}")
-
-    file_hash8 = compute_hash8(pes_path)
-    cache = load_cache()
+    Shared body of the JSON conversions; preview_size=None skips the preview
     
-    pes_filename = os.path.basename(pes_path)
-    stitch_count = pattern.count_stitches()
-    bounds = pattern.bounds()
+    The preview renders in parallel with building the JSON, through
+    render_preview(pes_path, preview_size, pattern) (generate_preview_fast
+    by default). Files seen before only need their preview rendered.
+    """
+    render_preview = render_preview or generate_preview_fast
+    file_hash8 = precomputed_hash8 or await asyncio.to_thread(compute_hash8, pes_path)
     
-    if bounds:
-        min_x, min_y, max_x, max_y = bounds
-        width_mm = round((max_x - min_x) / 10, 1)
-        height_mm = round((max_y - min_y) / 10, 1)
-    else:
-        width_mm = height_mm = 0
+    pes_data = _cached_pes_data(file_hash8, pes_path)
+    if pes_data is not None:
+        if preview_size is not None:
+            pes_data["preview"] = await asyncio.to_thread(render_preview, pes_path, preview_size)
+        return pes_data
     
-    color_blocks = build_color_blocks(pattern)
-    threads = pattern.threadlist or []
-    color_count = len({c for c in (thread_to_hex(t) for t in threads) if c})
-    stop_flags = [block.get("stop_funshion", False) for block in color_blocks]
-    metrics = compute_metrics(pattern)
+    pattern, cached_entry = await _load_inputs(pes_path, file_hash8)
     
-    colors = []
-    for idx, block in enumerate(color_blocks):
-        thread = block.get("thread")
-        color_num = idx + 1
-        color_rgb = thread.color if thread else 0
-        st_count = block.get("stitch_count", 0)
-        
-        code = getattr(thread, "catalog_number", "")
-        color_way = code.split("-")[1] if code and "-" in code else code
-        name = getattr(thread, "description", "")
-        chart = getattr(thread, "brand", "")
-        
-        display_code = code
-        if chart in ["Metro Pro", "Lemiex"] and "-" in code:
-            parts = code.split("-")
-            if len(parts) == 2:
-                try:
-                    num1, num2 = int(parts[0]), int(parts[1])
-                    display_code = str(min(num1, num2))
-                except ValueError:
-                    pass
-        
-        stop_flag = bool(stop_flags[idx]) if idx < len(stop_flags) else False
-        if stop_flag and name:
-            name = f"{name}, Stop"
-
-        colors.append({
-            "id": color_num,
-            "sequence": color_num,
-            "needle_number": None,
-            "code": display_code,
-            "original_code": code,
-            "color_way": color_way,
-            "name": name,
-            "chart": chart,
-            "rgb_int": color_rgb,
-            "rgb_hex": rgb_to_hex(color_rgb),
-            "stitch_count": st_count,
-            "stop_funshion": stop_flag,
-        })
+    jobs = [asyncio.to_thread(build_pes_data, pes_path, pattern, file_hash8, cached_entry)]
+    if preview_size is not None:
+        jobs.append(asyncio.to_thread(render_preview, pes_path, preview_size, pattern))
+    # Wait for both jobs even if one fails, so a preview already rendered to
+    # a temp file (render_preview_file) can be removed instead of leaking
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    pes_data, *preview = results
+    failure = next((result for result in results if isinstance(result, BaseException)), None)
+    if failure is not None:
+        if preview and isinstance(preview[0], str):
+            try:
+                os.remove(preview[0])
+            except OSError:
+                pass
+        raise failure
     
-    pes_data = {
-        "file_info": {
-            "filename": pes_filename,
-            "filepath": pes_path,
-            "hash8": file_hash8,
-            "stitch_count": stitch_count,
-            "width_mm": width_mm,
-            "height_mm": height_mm,
-            "color_count": color_count,
-            "area_mm2": metrics["area_mm2"],
-            "color_changes": metrics["color_changes"],
-            "stops": len(colors),
-            "trims": metrics["trims"],
-            "appliques": metrics["appliques"],
-        },
-        "preview": None,  # No preview
-        "colors": colors,
-        "needle_assignment": {
-            "assignments": {},
-            "defaults": {
-                "black_needle": 5,
-                "white_needle": 8
-            }
-        },
-        "metadata": {
-            "generated_by": "pes_converter.py",
-            "version": "1.0",
-            "pyembroidery_bounds": bounds
-        }
-    }
+    _remember_pes_data(file_hash8, pes_data)
+    if preview:
+        pes_data["preview"] = preview[0]
     
-    cached_entry = cache.get(file_hash8)
-    if cached_entry and cached_entry.get("assignments"):
-        needle_assignments = cached_entry["assignments"]
-        cached_colors = {c.get("sequence"): c.get("needle_number") for c in cached_entry.get("colors", [])}
-        for color in colors:
-            nn = cached_colors.get(color["sequence"])
-            color["needle_number"] = nn if nn is not None else color.get("needle_number")
-    else:
-        needle_assignments = assign_colors_to_needles(colors)
-        cache[file_hash8] = {
-            "assignments": needle_assignments,
-            "colors": [{"sequence": c["sequence"], "needle_number": c["needle_number"]} for c in colors],
-        }
-        save_cache(cache)
+    return pes_data
+
+
+async def process_pes_to_json_fast(
+    pes_path: str,
+    preview_size: int = 400,
+    precomputed_hash8: Optional[str] = None,
+) -> Dict:
+    """
+    Fast PES to JSON conversion with smaller preview
     
-    pes_data["needle_assignment"]["assignments"] = needle_assignments
+    Pass precomputed_hash8 when the file was hashed while being written.
+    """
+    return await _process_pes_core(pes_path, preview_size, precomputed_hash8)
+
+
+async def process_pes_to_json_preview_file(
+    pes_path: str,
+    preview_size: int = 400,
+    precomputed_hash8: Optional[str] = None,
+) -> Tuple[Dict, str]:
+    """
+    PES to JSON plus the fast preview rendered to a temp PNG, decoding once
     
-    return pes_data
+    Returns (pes_data, png_path); the caller removes the file.
+    """
+    pes_data = await _process_pes_core(pes_path, preview_size, precomputed_hash8, render_preview_file)
+    return pes_data, pes_data.pop("preview")
 
 
-def generate_preview_fast(pes_path: str, max_size: int = 400) -> Dict[str, str]:
+async def process_pes_to_json_no_preview(pes_path: str, precomputed_hash8: Optional[str] = None) -> Dict:
     """
-    Generate smaller preview for faster response
+    Ultra-fast PES to JSON without preview generation
     """
-    pes_file = pathlib.Path(pes_path)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmpfile:
-        png_path = tmpfile.name
+    return await _process_pes_core(pes_path, None, precomputed_hash8)
+
+
+def _render_fast_preview(pes_path: str, max_size: int, pattern, target) -> None:
+    """Render the fast preview of a PES file to a path or binary file object"""
+    if pattern is None:
+        pattern = read(str(pes_path))
+        if pattern is None:
+            raise ValueError(f"Unable to read PES pattern from {pes_path}")
+
+    render_pattern(
+        pattern,
+        png_path=target,
+        background=None,
+        linewidth=1,  # Thinner line = faster
+        margin=0,
+        max_size=max_size,  # Smaller size
+        native_size=True,
+        output_base64=False,
+    )
+
+
+def render_preview_file(pes_path: str, max_size: int = 400, pattern=None) -> str:
+    """
+    Render the fast preview to a temp PNG and return its path
+    
+    Pass an already decoded pattern to skip re-reading pes_path.
+    The caller removes the file.
+    """
+    png_path = make_temp_path(".png")
 
     try:
-        render_pes(
-            pes_path=pes_file,
-            png_path=pathlib.Path(png_path),
-            background=None,
-            linewidth=1,  # Thinner line = faster
-            margin=0,
-            max_size=max_size,  # Smaller size
-            native_size=True,
-            output_base64=False,
-        )
-        with open(png_path, "rb") as img_file:
-            img_data = base64.b64encode(img_file.read()).decode("ascii")
-    finally:
+        _render_fast_preview(pes_path, max_size, pattern, pathlib.Path(png_path))
+    except BaseException:
         try:
             os.remove(png_path)
         except OSError:
             pass
+        raise
 
-    return {
-        "image_data": img_data,
-        "format": "png",
-        "encoding": "base64",
-    }
+    return png_path
+
+
+def generate_preview_fast(pes_path: str, max_size: int = 400, pattern=None) -> Dict[str, str]:
+    """
+    Generate smaller preview for faster response
+    
+    Pass an already decoded pattern to skip re-reading pes_path.
+    The PNG is rendered in memory.
+    """
+    buffer = io.BytesIO()
+    _render_fast_preview(pes_path, max_size, pattern, buffer)
+    return preview_payload(buffer)
 
 
 def generate_pes_preview(
@@ -320,25 +383,18 @@ def generate_pes_preview(
         linewidth: Line thickness
     
     Returns:
-        PNG image data as bytes
+        PNG image data as bytes (rendered in memory)
     """
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_png:
-        tmp_png_path = tmp_png.name
+    buffer = io.BytesIO()
+    render_pes(
+        pes_path=pathlib.Path(pes_path),
+        png_path=buffer,
+        background=None,
+        linewidth=linewidth,
+        margin=0,
+        max_size=max_size,
+        native_size=True,
+        output_base64=False,
+    )
     
-    try:
-        render_pes(
-            pes_path=pathlib.Path(pes_path),
-            png_path=pathlib.Path(tmp_png_path),
-            background=None,
-            linewidth=linewidth,
-            margin=0,
-            max_size=max_size,
-            native_size=True,
-            output_base64=False,
-        )
-        
-        with open(tmp_png_path, "rb") as f:
-            return f.read()
-    finally:
-        if os.path.exists(tmp_png_path):
-            os.unlink(tmp_png_path)
+    return buffer.getvalue()
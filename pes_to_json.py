@@ -5,106 +5,241 @@ Converts PES embroidery files to JSON format for web interface
 Based on pesinfo.py functionality
 """
 
+import io
 import os
 import json
-import tempfile
-import base64
 import argparse
-import pathlib
-from typing import Dict, List
+import functools
+from typing import Dict, List, Optional, Tuple
 import hashlib
 import json
+import mmap
+import re
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
 from pyembroidery import COLOR_CHANGE, END, STOP, TRIM, STITCH, read
+
+try:
+    # SIMD base64 encoder, a drop-in for the stdlib one
+    from pybase64 import b64encode
+except ImportError:
+    from base64 import b64encode
+
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+# Single-file needle cache of earlier versions. Frozen: it stays in git as a
+# read-only fallback and is never rewritten or migrated (see CACHE_DIR)
 CACHE_FILE = os.path.join(os.path.dirname(__file__), "needle_cache.json")
+# Rendered previews, one <hash8>.png per file (the render settings are fixed)
+PREVIEW_CACHE_DIR = os.path.join(os.path.dirname(__file__), "preview_cache")
 
 
 def compute_hash8(pes_path: str) -> str:
-    """Compute short hash of PES file contents (first 8 hex chars of sha256)."""
-    h = hashlib.sha256()
+    """Compute short hash of PES file contents (first 8 hex chars of sha256).
+
+    The file is hashed through a read-only mmap in one call, so hashlib
+    works on the whole buffer at once (without holding the GIL) instead
+    of a Python read loop. sha256 stays: hash8 keys saved needle assignments.
+    """
     with open(pes_path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()[:8]
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                return hashlib.sha256(view).hexdigest()[:8]
+        except ValueError:
+            # Empty files cannot be mapped
+            return hashlib.sha256(f.read()).hexdigest()[:8]
+
+
+# Needle cache entries, one <hash8>.json per file (local state, git-ignored)
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "needle_cache")
 
+# In-process copy of the old single-file cache (CACHE_FILE), re-read only
+# when the file changes. It is no longer written; its entries are used for
+# hashes that have no file in CACHE_DIR yet.
+_legacy_cache = None
+_legacy_cache_mtime = None
+_legacy_cache_lock = threading.Lock()
 
-def load_cache() -> Dict:
-    if not os.path.exists(CACHE_FILE):
-        return {}
+
+def _cache_file_mtime():
+    try:
+        return os.stat(CACHE_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load_legacy_cache() -> Dict:
+    """Return the old single-file needle cache (parsed only when it changed on disk)."""
+    global _legacy_cache, _legacy_cache_mtime
+    with _legacy_cache_lock:
+        mtime = _cache_file_mtime()
+        if _legacy_cache is not None and mtime == _legacy_cache_mtime:
+            return _legacy_cache
+        cache = {}
+        if mtime is not None:
+            try:
+                with open(CACHE_FILE, "r", encoding="utf-8") as f:
+                    cache = json.load(f)
+            except Exception:
+                cache = {}
+        _legacy_cache, _legacy_cache_mtime = cache, mtime
+        return cache
+
+
+def load_cache_entry(file_hash8: str) -> Optional[Dict]:
+    """Return the needle cache entry of a file hash, or None (reads only that entry)."""
     try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+        with open(os.path.join(CACHE_DIR, f"{file_hash8}.json"), "r", encoding="utf-8") as f:
             return json.load(f)
+    except FileNotFoundError:
+        return _load_legacy_cache().get(file_hash8)
     except Exception:
-        return {}
+        return None
 
 
-def save_cache(cache: Dict) -> None:
+def save_cache_entry(file_hash8: str, entry: Dict) -> None:
+    """Write one needle cache entry atomically (temp file + rename)."""
+    entry_path = os.path.join(CACHE_DIR, f"{file_hash8}.json")
+    tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache, f, indent=2, ensure_ascii=False)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(_dumps(entry))
+        os.replace(tmp_path, entry_path)
     except Exception:
-        pass
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_cached_preview(file_hash8: str) -> Optional[bytes]:
+    """Return the cached preview PNG for a file hash, or None."""
+    try:
+        with open(os.path.join(PREVIEW_CACHE_DIR, f"{file_hash8}.png"), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def save_cached_preview(file_hash8: str, png_bytes: bytes) -> None:
+    """Store a preview PNG for a file hash atomically; failures only skip caching."""
+    png_path = os.path.join(PREVIEW_CACHE_DIR, f"{file_hash8}.png")
+    tmp_path = f"{png_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(PREVIEW_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(png_bytes)
+        os.replace(tmp_path, png_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 # APPLIQUE symbol is not always present; guard access dynamically
 APPLIQUE = getattr(__import__("pyembroidery"), "APPLIQUE", None)
-from render_pes_trueview import render_pes as render_trueview
+from render_pes_trueview import render_pattern as render_trueview
 
+# Two-digit uppercase hex for every byte value, indexed by rgb_to_hex
+_HEX_BYTE = [f"{i:02X}" for i in range(256)]
+
+@functools.lru_cache(maxsize=1024)
 def rgb_to_hex(rgb_int):
     """Convert RGB integer to hex color string"""
-    r = (rgb_int >> 16) & 0xFF
-    g = (rgb_int >> 8) & 0xFF
-    b = rgb_int & 0xFF
-    return f"#{r:02X}{g:02X}{b:02X}"
+    return "#" + _HEX_BYTE[(rgb_int >> 16) & 0xFF] + _HEX_BYTE[(rgb_int >> 8) & 0xFF] + _HEX_BYTE[rgb_int & 0xFF]
+
+
+# Thread charts whose "a-b" codes are displayed as the smaller number
+_SHORT_CODE_CHARTS = frozenset({"Metro Pro", "Lemiex"})
+# "a-b" catalog codes made of two plain numbers
+_NUMERIC_CODE = re.compile(r"([0-9]+)-([0-9]+)")
+
+
+def thread_display_code(code: str, chart: str) -> str:
+    """Code shown for a thread: the smaller number of an "a-b" code on Metro Pro and Lemiex charts, else the code."""
+    if code and chart in _SHORT_CODE_CHARTS:
+        match = _NUMERIC_CODE.fullmatch(code)
+        if match:
+            # Smaller number compared as strings: same as str(min(int(a), int(b)))
+            a, b = (digits.lstrip("0") or "0" for digits in match.groups())
+            return a if (len(a), a) <= (len(b), b) else b
+    return code
 
 
 def thread_to_hex(thread) -> str:
     """Best-effort hex color from thread object."""
     if thread is None:
         return ""
-    if hasattr(thread, "hex_color"):
-        val = thread.hex_color
-        val = val() if callable(val) else val
-        if val:
-            val = str(val)
-            return val if val.startswith("#") else f"#{val}"
-    color_val = getattr(thread, "color", None)
-    if isinstance(color_val, int):
-        return rgb_to_hex(color_val)
-    return ""
-
-
-def generate_preview_base64(pes_path: str) -> Dict[str, str]:
-    """Render TrueView preview and return base64 payload."""
-    pes_file = pathlib.Path(pes_path)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmpfile:
-        png_path = tmpfile.name
-
+    # EmbThread keeps its RGB in .color; hex_color() only re-formats it
     try:
-        render_trueview(
-            pes_path=pes_file,
-            png_path=pathlib.Path(png_path),
-            background=None,
-            linewidth=2,
-            margin=0,
-            max_size=800,
-            native_size=True,
-            output_base64=False,
-        )
-        with open(png_path, "rb") as img_file:
-            img_data = base64.b64encode(img_file.read()).decode("ascii")
-    finally:
-        try:
-            os.remove(png_path)
-        except OSError:
-            pass
+        color_val = thread.color
+    except AttributeError:
+        return ""
+    return rgb_to_hex(color_val) if isinstance(color_val, int) else ""
+
+
+def preview_payload(png) -> Dict[str, str]:
+    """Base64 preview payload of PNG data (bytes, or a BytesIO holding a render).
 
+    A BytesIO is encoded through its buffer and closed before the text
+    copy is made, so the raw PNG, its base64 bytes and the final str are
+    never all alive at once.
+    """
+    if isinstance(png, io.BytesIO):
+        encoded = b64encode(png.getbuffer())
+        png.close()
+    else:
+        encoded = b64encode(png)
     return {
-        "image_data": img_data,
+        "image_data": encoded.decode("ascii"),
         "format": "png",
         "encoding": "base64",
     }
 
 
+def generate_preview_base64(pes_path: str, pattern=None, file_hash8: Optional[str] = None) -> Dict[str, str]:
+    """Render TrueView preview and return base64 payload (reuses `pattern` if given).
+
+    With file_hash8, a preview cached for that hash is returned without
+    rendering, and a fresh render is added to the cache.
+    """
+    png_bytes = load_cached_preview(file_hash8) if file_hash8 else None
+    if png_bytes is not None:
+        return preview_payload(png_bytes)
+
+    if pattern is None:
+        pattern = read(str(pes_path))
+        if pattern is None:
+            raise ValueError(f"Unable to read PES pattern from {pes_path}")
+
+    # Render straight into memory, no temp file round-trip
+    buffer = io.BytesIO()
+    render_trueview(
+        pattern,
+        png_path=buffer,
+        background=None,
+        linewidth=2,
+        margin=0,
+        max_size=800,
+        native_size=True,
+        output_base64=False,
+    )
+
+    if file_hash8:
+        save_cached_preview(file_hash8, buffer.getbuffer())
+    return preview_payload(buffer)
+
+
 def compute_stop_flags(pattern, block_count: int) -> List[bool]:
     """Mark whether each color block has a STOP command before its color change."""
     stop_flags = [False] * block_count
@@ -122,56 +257,22 @@ def compute_stop_flags(pattern, block_count: int) -> List[bool]:
     return stop_flags
 
 
-def compute_metrics(pattern) -> Dict[str, float]:
-    """Compute high-level stitch metrics similar to extract_pes.py."""
-    stitches = pattern.stitches or []
-    if not stitches:
-        return {
-            "area_mm2": 0.0,
-            "color_changes": 0,
-            "stops": 0,
-            "trims": 0,
-            "appliques": 0,
-        }
-
-    UNITS_TO_MM = 0.1
-
-    xs = [pt[0] for pt in stitches]
-    ys = [pt[1] for pt in stitches]
-    width_mm = (max(xs) - min(xs)) * UNITS_TO_MM if xs else 0.0
-    height_mm = (max(ys) - min(ys)) * UNITS_TO_MM if ys else 0.0
-    area_mm2 = round(width_mm * height_mm, 1)
-
-    color_changes = sum(1 for _, _, cmd in stitches if cmd == COLOR_CHANGE)
-    stops = sum(1 for _, _, cmd in stitches if cmd == STOP)
-    trims = sum(1 for _, _, cmd in stitches if cmd == TRIM)
-    appliques = (
-        sum(1 for _, _, cmd in stitches if cmd == APPLIQUE)
-        if APPLIQUE is not None
-        else 0
-    )
-
-    return {
-        "area_mm2": area_mm2,
-        "color_changes": color_changes,
-        "stops": stops,
-        "trims": trims,
-        "appliques": appliques,
-    }
-
+def scan_pattern(pattern) -> Tuple[List[Dict], Dict[str, float]]:
+    """Walk the stitches once and return (color blocks, metrics).
 
-def build_color_blocks(pattern) -> List[Dict]:
-    """Segment stitches into color blocks, capturing stop flag and stitch count per block."""
+    Fuses build_color_blocks and compute_metrics: blocks stop at the first
+    END as before, while bounds and command counts cover every entry.
+    """
+    stitches = pattern.stitches or []
+    threads = getattr(pattern, "threadlist", None) or []
+    last_thread = len(threads) - 1
     blocks: List[Dict] = []
     thread_idx = 0
     stitch_count = 0
 
     def append_block(stop_flag: bool):
-        nonlocal stitch_count, thread_idx
-        thread = None
-        if getattr(pattern, "threadlist", None):
-            idx = min(thread_idx, len(pattern.threadlist) - 1)
-            thread = pattern.threadlist[idx]
+        nonlocal stitch_count
+        thread = threads[min(thread_idx, last_thread)] if threads else None
         blocks.append(
             {
                 "thread": thread,
@@ -181,21 +282,76 @@ def build_color_blocks(pattern) -> List[Dict]:
         )
         stitch_count = 0
 
-    for _, _, cmd in pattern.stitches:
+    if not stitches:
+        return blocks, {
+            "area_mm2": 0.0,
+            "color_changes": 0,
+            "stops": 0,
+            "trims": 0,
+            "appliques": 0,
+        }
+
+    UNITS_TO_MM = 0.1
+
+    min_x = max_x = stitches[0][0]
+    min_y = max_y = stitches[0][1]
+    color_changes = stops = trims = appliques = 0
+    ended = False
+
+    # Plain loop on purpose: converting the stitch list to a NumPy array
+    # alone takes longer than this whole pass
+    for x, y, cmd in stitches:
+        if x < min_x:
+            min_x = x
+        elif x > max_x:
+            max_x = x
+        if y < min_y:
+            min_y = y
+        elif y > max_y:
+            max_y = y
+
         if cmd == STITCH:
-            stitch_count += 1
+            if not ended:
+                stitch_count += 1
         elif cmd == STOP:
-            append_block(True)
+            stops += 1
+            if not ended:
+                append_block(True)
         elif cmd == COLOR_CHANGE:
-            append_block(False)
-            thread_idx += 1
+            color_changes += 1
+            if not ended:
+                append_block(False)
+                thread_idx += 1
+        elif cmd == TRIM:
+            trims += 1
         elif cmd == END:
-            break
+            ended = True
+        elif APPLIQUE is not None and cmd == APPLIQUE:
+            appliques += 1
 
     if stitch_count:
         append_block(False)
 
-    return blocks
+    width_mm = (max_x - min_x) * UNITS_TO_MM
+    height_mm = (max_y - min_y) * UNITS_TO_MM
+
+    return blocks, {
+        "area_mm2": round(width_mm * height_mm, 1),
+        "color_changes": color_changes,
+        "stops": stops,
+        "trims": trims,
+        "appliques": appliques,
+    }
+
+
+def compute_metrics(pattern) -> Dict[str, float]:
+    """Compute high-level stitch metrics similar to extract_pes.py."""
+    return scan_pattern(pattern)[1]
+
+
+def build_color_blocks(pattern) -> List[Dict]:
+    """Segment stitches into color blocks, capturing stop flag and stitch count per block."""
+    return scan_pattern(pattern)[0]
 
 def assign_colors_to_needles(colors):
     """
@@ -211,7 +367,6 @@ def assign_colors_to_needles(colors):
         needle_assignments[str(i)] = None
     
     used_needles = set()
-    assigned_colors = set()
     
     print("\n" + "="*50)
     print("NEEDLE ASSIGNMENT LOGIC")
@@ -222,16 +377,20 @@ def assign_colors_to_needles(colors):
     white_colors = []
     other_colors = []
     
+    # Plain loop on purpose: palettes are a few dozen colors at most, where
+    # building NumPy arrays costs more than classifying them in Python
     for color in colors:
-        r = (color["rgb_int"] >> 16) & 0xFF
-        g = (color["rgb_int"] >> 8) & 0xFF
-        b = color["rgb_int"] & 0xFF
+        rgb_int = color["rgb_int"]
+        code = color["code"]
+        r = (rgb_int >> 16) & 0xFF
+        g = (rgb_int >> 8) & 0xFF
+        b = rgb_int & 0xFF
         
         # Check if it's black (code 137 or very dark RGB)
-        if color["code"] == "137" or (r < 50 and g < 50 and b < 50):
+        if code == "137" or (r < 50 and g < 50 and b < 50):
             black_colors.append(color)
         # Check if it's white (code 135 or very light RGB)
-        elif color["code"] == "135" or (r > 200 and g > 200 and b > 200):
+        elif code == "135" or (r > 200 and g > 200 and b > 200):
             white_colors.append(color)
         else:
             other_colors.append(color)
@@ -249,7 +408,6 @@ def assign_colors_to_needles(colors):
         # Assign needle 5 to ALL black colors
         for black_color in black_colors:
             black_color["needle_number"] = 5
-            assigned_colors.add(black_color["id"])
         
         print(f"✓ FORCED: {len(black_colors)} Black colors ({first_black['code']}) -> Needle 5")
     
@@ -266,15 +424,12 @@ def assign_colors_to_needles(colors):
         # Assign needle 8 to ALL white colors
         for white_color in white_colors:
             white_color["needle_number"] = 8
-            assigned_colors.add(white_color["id"])
             
         print(f"✓ FORCED: {len(white_colors)} White colors ({first_white['code']}) -> Needle 8")
     
-    # Step 2: Collect remaining colors (including remaining black/white if any)
-    remaining_colors = []
-    for color in colors:
-        if color["id"] not in assigned_colors:
-            remaining_colors.append(color)
+    # Step 2: Remaining colors are the ones classified as neither black nor
+    # white (every black/white color was assigned above)
+    remaining_colors = other_colors
 
     # Step 3: Group colors by code+rgb to handle duplicates smartly
     color_groups = {}
@@ -289,9 +444,10 @@ def assign_colors_to_needles(colors):
     # Step 4: Assign needles to unique colors first
     available_needles = [i for i in range(1, 13) if i not in used_needles]    # Shuffle for random assignment but use consistent seed for reproducibility
     unique_color_keys = list(color_groups.keys())
-    seed_value = hash(''.join(sorted(unique_color_keys))) % 2147483647
-    random.seed(seed_value)
-    random.shuffle(available_needles)
+    # crc32 is stable across runs (str hash() is randomized per process); a
+    # private Random keeps concurrent conversions from sharing one RNG state
+    seed_value = zlib.crc32("\0".join(sorted(unique_color_keys)).encode("utf-8"))
+    random.Random(seed_value).shuffle(available_needles)
     
     print(f"🎲 Using seed {seed_value} for reproducible random assignment")
     print(f"📍 Available needles: {available_needles}")
@@ -327,13 +483,35 @@ def assign_colors_to_needles(colors):
     print("="*50)
     return needle_assignments
 
-def process_pes_to_json(pes_path, output_path=None):
+def _thread_fields(thread) -> Tuple:
+    """Parse a block's thread into (code, display_code, color_way, name, chart, rgb_int, rgb_hex)."""
+    color_rgb = thread.color if thread else 0
+
+    # Extract thread information
+    code = getattr(thread, "catalog_number", "")
+    if code and "-" in code:
+        color_way = code.split("-")[1]
+    else:
+        color_way = code
+
+    name = getattr(thread, "description", "")
+    chart = getattr(thread, "brand", "")
+
+    display_code = thread_display_code(code, chart)
+
+    return code, display_code, color_way, name, chart, color_rgb, rgb_to_hex(color_rgb)
+
+
+def process_pes_to_json(pes_path, output_path=None, generate_preview=True):
     """
     Convert PES file to JSON format
     
     Args:
         pes_path: Path to PES file
         output_path: Output JSON path (optional)
+        generate_preview: Render the base64 preview (default True). When
+            False "preview" is null; file_info, colors and needle
+            assignments are unaffected.
     
     Returns:
         dict: PES data in JSON format
@@ -346,10 +524,12 @@ def process_pes_to_json(pes_path, output_path=None):
         raise ValueError(f"Unable to read PES pattern from {pes_path}")
 
     file_hash8 = compute_hash8(pes_path)
-    cache = load_cache()
+    cached_entry = load_cache_entry(file_hash8)
 
-    # Generate preview image using TrueView renderer
-    preview_data = generate_preview_base64(pes_path)
+    # Generate preview image using TrueView renderer (the costliest step)
+    preview_data = None
+    if generate_preview:
+        preview_data = generate_preview_base64(pes_path, pattern=pattern, file_hash8=file_hash8)
     
     # Get basic file information
     pes_filename = os.path.basename(pes_path)
@@ -363,43 +543,25 @@ def process_pes_to_json(pes_path, output_path=None):
     else:
         width_mm = height_mm = 0
     
-    color_blocks = build_color_blocks(pattern)
+    color_blocks, metrics = scan_pattern(pattern)
     # Capture threads for code/name/chart extraction while keeping block segmentation
     threads = pattern.threadlist or []
     color_count = len({c for c in (thread_to_hex(t) for t in threads) if c})
-    stop_flags = [block.get("stop_funshion", False) for block in color_blocks]
-    metrics = compute_metrics(pattern)
     
-    # Process color information
+    # Process color information; blocks sharing a thread parse it once
     colors = []
+    thread_fields = {}
     for idx, block in enumerate(color_blocks):
         thread = block.get("thread")
         color_num = idx + 1
-        color_rgb = thread.color if thread else 0
         st_count = block.get("stitch_count", 0)
         
-        # Extract thread information
-        code = getattr(thread, "catalog_number", "")
-        if code and "-" in code:
-            color_way = code.split("-")[1]
-        else:
-            color_way = code
+        fields = thread_fields.get(id(thread))
+        if fields is None:
+            fields = thread_fields[id(thread)] = _thread_fields(thread)
+        code, display_code, color_way, name, chart, color_rgb, rgb_hex = fields
         
-        name = getattr(thread, "description", "")
-        chart = getattr(thread, "brand", "")
-        
-        # Process display code for Metro Pro and Lemiex charts
-        display_code = code
-        if chart in ["Metro Pro", "Lemiex"] and "-" in code:
-            parts = code.split("-")
-            if len(parts) == 2:
-                try:
-                    num1, num2 = int(parts[0]), int(parts[1])
-                    display_code = str(min(num1, num2))
-                except ValueError:
-                    display_code = code
-        
-        stop_flag = bool(stop_flags[idx]) if idx < len(stop_flags) else False
+        stop_flag = bool(block.get("stop_funshion", False))
         if stop_flag:
             if name:
                 name = f"{name}, Stop"
@@ -416,7 +578,7 @@ def process_pes_to_json(pes_path, output_path=None):
             "name": name,
             "chart": chart,
             "rgb_int": color_rgb,
-            "rgb_hex": rgb_to_hex(color_rgb),
+            "rgb_hex": rgb_hex,
             "stitch_count": st_count,
             "stop_funshion": stop_flag,
         }
@@ -456,7 +618,6 @@ def process_pes_to_json(pes_path, output_path=None):
     }
     
     # Auto-assign colors to needles with smart placement, unless cached
-    cached_entry = cache.get(file_hash8)
     if cached_entry and cached_entry.get("assignments"):
         needle_assignments = cached_entry["assignments"]
         # Restore color needle_number from cache if available
@@ -467,44 +628,28 @@ def process_pes_to_json(pes_path, output_path=None):
         print(f"📌 Cache hit for hash {file_hash8}, reusing needle assignments")
     else:
         needle_assignments = assign_colors_to_needles(colors)
-        cache[file_hash8] = {
+        save_cache_entry(file_hash8, {
             "assignments": needle_assignments,
             "colors": [{"sequence": c["sequence"], "needle_number": c["needle_number"]} for c in colors],
-        }
-        save_cache(cache)
+        })
     
     # Update needle_assignment section with actual assignments
     pes_data["needle_assignment"]["assignments"] = needle_assignments
     
     # Save to JSON file if output path specified
     if output_path:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(pes_data, f, indent=2, ensure_ascii=False)
+        with open(output_path, 'wb') as f:
+            f.write(_dumps(pes_data))
         print(f"JSON saved to: {output_path}")
     
     return pes_data
 
-def main():
-    parser = argparse.ArgumentParser(description='Convert PES files to JSON format')
-    parser.add_argument('input', help='Input PES file path')
-    parser.add_argument('-o', '--output', help='Output JSON file path')
-    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
-    
-    args = parser.parse_args()
-    
-    if not os.path.exists(args.input):
-        print(f"Error: File not found: {args.input}")
-        return 1
-    
-    # Generate output path if not specified
-    if not args.output:
-        base_name = os.path.splitext(args.input)[0]
-        args.output = base_name + '.json'
-    
+def _report(input_path, output_path, convert, verbose):
+    """Run one conversion and print its summary; returns False on failure."""
     try:
-        pes_data = process_pes_to_json(args.input, args.output)
+        pes_data = convert()
         
-        if args.verbose:
+        if verbose:
             print("\n" + "="*50)
             print("PES FILE ANALYSIS")
             print("="*50)
@@ -517,16 +662,55 @@ def main():
                 print(f"  {color['sequence']:2d}. Code {color['code']:>3} - {color['name']} ({color['chart']})")
             
         print(f"\n✅ Successfully converted PES to JSON!")
-        print(f"📄 Input: {args.input}")
-        print(f"💾 Output: {args.output}")
+        print(f"📄 Input: {input_path}")
+        print(f"💾 Output: {output_path}")
         
     except Exception as e:
-        print(f"❌ Error processing PES file: {e}")
+        print(f"❌ Error processing PES file {input_path}: {e}")
         import traceback
         traceback.print_exc()
+        return False
+    
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert PES files to JSON format')
+    parser.add_argument('input', nargs='+', help='Input PES file path(s)')
+    parser.add_argument('-o', '--output', help='Output JSON file path (single input only)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('--no-preview', dest='preview', action='store_false',
+                        help='Skip the preview image (much faster; colors and needles unchanged)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for multiple inputs (default: CPU count)')
+    
+    args = parser.parse_args()
+    
+    if args.output and len(args.input) > 1:
+        parser.error('--output can only be used with a single input')
+    
+    missing = [path for path in args.input if not os.path.exists(path)]
+    for path in missing:
+        print(f"Error: File not found: {path}")
+    if missing:
         return 1
     
-    return 0
+    # Generate output paths if not specified
+    jobs = [(path, args.output or os.path.splitext(path)[0] + '.json') for path in args.input]
+    
+    ok = True
+    if len(jobs) > 1 and args.jobs > 1:
+        # Conversion is CPU-bound, so fan files out to processes. Needle cache
+        # entries are separate files written by atomic rename, so workers
+        # never contend on a shared cache.
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs))) as pool:
+            futures = [pool.submit(process_pes_to_json, path, output, args.preview) for path, output in jobs]
+            for (path, output), future in zip(jobs, futures):
+                ok &= _report(path, output, future.result, args.verbose)
+    else:
+        for path, output in jobs:
+            ok &= _report(path, output, functools.partial(process_pes_to_json, path, output, args.preview), args.verbose)
+    
+    return 0 if ok else 1
 
 if __name__ == "__main__":
     exit(main())
\ No newline at end of file
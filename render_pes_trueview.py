@@ -2,7 +2,7 @@ import argparse
 import base64
 import io
 import pathlib
-from typing import List, Optional, Tuple
+from typing import BinaryIO, List, Optional, Tuple, Union
 
 from pyembroidery import STITCH, read
 
@@ -78,11 +78,8 @@ def _apply_shade(rgb: Tuple[int, int, int], factor: float) -> Tuple[int, int, in
     return (r, g, b)
 
 
-def _extract_satin_columns(block: List[Tuple[float, float, int]]):
-    """Detect satin columns as alternating zig-zag STITCH pairs.
-
-    Tighten opposite-direction requirement to avoid mis-labeling tatami as satin.
-    """
+def _stitch_dirs(block: List[Tuple[float, float, int]]) -> List[Tuple[float, float]]:
+    """Unit direction of each non-zero STITCH-to-STITCH segment of a block."""
     dirs = []
     for (x0, y0, c0), (x1, y1, c1) in zip(block, block[1:]):
         if c0 != STITCH or c1 != STITCH:
@@ -92,16 +89,32 @@ def _extract_satin_columns(block: List[Tuple[float, float, int]]):
         if mag == 0:
             continue
         dirs.append((dx / mag, dy / mag))
+    return dirs
+
+
+def _extract_satin_columns(block: List[Tuple[float, float, int]], dirs: Optional[List[Tuple[float, float]]] = None):
+    """Detect satin columns as alternating zig-zag STITCH pairs.
+
+    Tighten opposite-direction requirement to avoid mis-labeling tatami as satin.
+    Pass dirs when the caller already has _stitch_dirs(block).
+    """
+    if dirs is None:
+        dirs = _stitch_dirs(block)
 
     if len(dirs) < 4:
         return []
 
-    opposite = 0
+    # Count down the most opposite turns still possible, and give up as soon
+    # as even that can no longer reach the satin ratio (tatami fails early)
+    n = len(dirs)
+    opposite = n - 1
     for (dx1, dy1), (dx2, dy2) in zip(dirs, dirs[1:]):
-        if dx1 * dx2 + dy1 * dy2 < -0.2:
-            opposite += 1
+        if dx1 * dx2 + dy1 * dy2 >= -0.2:
+            opposite -= 1
+            if opposite / n < 0.55:
+                return []
 
-    if opposite / len(dirs) < 0.55:
+    if opposite / n < 0.55:
         return []
 
     columns = []
@@ -130,28 +143,38 @@ def _satin_shade(color: Tuple[int, int, int]):
     return shade_at
 
 
-def _render_satin_column(draw, left, right, color, width):
+def _satin_fills(color: Tuple[int, int, int], width: int) -> List[Tuple[int, int, int, int]]:
+    """RGBA fill of each step across a satin column (the same for every column of a block)."""
     shade = _satin_shade(color)
     steps = max(8, min(24, width * 2))
+    fills = []
+    for i in range(steps):
+        t0 = i / steps
+        t1 = (i + 1) / steps
+        fills.append(shade((t0 + t1) * 0.5) + (255,))
+    return fills
+
+
+def _render_satin_column(draw, left, right, fills, width):
+    # Each stroke is a single segment: no joints, so no joint="curve" either
+    steps = len(fills)
     lx, ly = left
     rx, ry = right
-    for i in range(steps):
+    for i, fill in enumerate(fills):
         t0 = i / steps
         t1 = (i + 1) / steps
-        mid_t = (t0 + t1) * 0.5
-        c = shade(mid_t)
         x0 = lx + (rx - lx) * t0
         y0 = ly + (ry - ly) * t0
         x1 = lx + (rx - lx) * t1
         y1 = ly + (ry - ly) * t1
-        draw.line((x0, y0, x1, y1), fill=c + (255,), width=width, joint="curve")
+        draw.line((x0, y0, x1, y1), fill=fill, width=width)
 
 
 def _render_tatami_block(draw, pts: List[Tuple[float, float]], color: Tuple[int, int, int], width: int):
     """Render tatami as alternating low-contrast rows."""
     if len(pts) < 2:
         return
-    shades = (0.92, 1.0)
+    fills = tuple(_apply_shade(color, shade) + (255,) for shade in (0.92, 1.0))
     run_idx = 0
     last_dir = None
     for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
@@ -165,24 +188,16 @@ def _render_tatami_block(draw, pts: List[Tuple[float, float]], color: Tuple[int,
             if dot < -0.2:
                 run_idx ^= 1
         last_dir = dir_vec
-        rgb = _apply_shade(color, shades[run_idx])
-        draw.line((x0, y0, x1, y1), fill=rgb + (255,), width=width, joint="curve")
+        draw.line((x0, y0, x1, y1), fill=fills[run_idx], width=width)
 
 
-def _tatami_score(block: List[Tuple[float, float, int]]) -> float:
+def _tatami_score(block: List[Tuple[float, float, int]], dirs: Optional[List[Tuple[float, float]]] = None) -> float:
     """Score how tatami-like a block is based on long, straight runs."""
     if len(block) < 15:
         return 0.0
 
-    dirs = []
-    for (x0, y0, c0), (x1, y1, c1) in zip(block, block[1:]):
-        if c0 != STITCH or c1 != STITCH:
-            continue
-        dx, dy = x1 - x0, y1 - y0
-        mag = (dx * dx + dy * dy) ** 0.5
-        if mag == 0:
-            continue
-        dirs.append((dx / mag, dy / mag))
+    if dirs is None:
+        dirs = _stitch_dirs(block)
 
     if len(dirs) < 12:
         return 0.0
@@ -216,7 +231,7 @@ def _tatami_score(block: List[Tuple[float, float, int]]) -> float:
 
 def render_pes(
     pes_path: pathlib.Path,
-    png_path: pathlib.Path,
+    png_path: Union[pathlib.Path, BinaryIO],
     *,
     background: Optional[str] = None,
     linewidth: Optional[int] = 2,
@@ -225,14 +240,43 @@ def render_pes(
     max_size: int = 1200,
     native_size: bool = False,
     output_base64: bool = False,
-) -> pathlib.Path:
-    """Render a PES to a TrueView-like PNG. Defaults to transparent background."""
+) -> Union[pathlib.Path, BinaryIO]:
+    """Render a PES to a TrueView-like PNG. Defaults to transparent background.
+
+    png_path may also be a binary file object (e.g. io.BytesIO) to skip the disk.
+    """
 
     pattern = read(str(pes_path))
     if pattern is None:
         raise ValueError(f"Unable to read PES file: {pes_path}")
 
-    pattern = pattern.copy()
+    return render_pattern(
+        pattern,
+        png_path,
+        background=background,
+        linewidth=linewidth,
+        scale=scale,
+        margin=margin,
+        max_size=max_size,
+        native_size=native_size,
+        output_base64=output_base64,
+    )
+
+
+def render_pattern(
+    pattern,
+    png_path: Union[pathlib.Path, BinaryIO],
+    *,
+    background: Optional[str] = None,
+    linewidth: Optional[int] = 2,
+    scale: Optional[float] = None,
+    margin: int = 20,
+    max_size: int = 1200,
+    native_size: bool = False,
+    output_base64: bool = False,
+) -> Union[pathlib.Path, BinaryIO]:
+    """Render an already decoded pattern like render_pes. The pattern is left unmodified."""
+
     min_x, min_y, max_x, max_y = pattern.bounds()
     width = max_x - min_x
     height = max_y - min_y
@@ -252,19 +296,23 @@ def render_pes(
         scale = usable / max(width, height) if max(width, height) else 1.0
 
     if scale != 1.0 or margin or min_x or min_y:
+        # Rescale a copy; untransformed patterns are only read below
+        pattern = pattern.copy()
         pattern.stitches = [
             ((x - min_x) * scale + margin, (y - min_y) * scale + margin, cmd)
             for (x, y, cmd) in pattern.stitches
         ]
+        # The rescale is monotonic per axis, so the new extremes are the old
+        # bounds passed through it (rounding included) and need no rescan
+        xs = ((min_x - min_x) * scale + margin, (max_x - min_x) * scale + margin)
+        ys = ((min_y - min_y) * scale + margin, (max_y - min_y) * scale + margin)
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
 
     Image, ImageDraw = _ensure_pillow()
     bg = _parse_color_tuple(background) if background else (0, 0, 0, 0)
-    min_x, min_y, max_x, max_y = 0, 0, 0, 0
-    if pattern.stitches:
-        xs = [s[0] for s in pattern.stitches]
-        ys = [s[1] for s in pattern.stitches]
-        min_x, max_x = min(xs), max(xs)
-        min_y, max_y = min(ys), max(ys)
+    if not pattern.stitches:
+        min_x, min_y, max_x, max_y = 0, 0, 0, 0
     width_px = int(max_x - min_x + margin * 2 + 2)
     height_px = int(max_y - min_y + margin * 2 + 2)
     width_px = max(width_px, 1)
@@ -284,15 +332,18 @@ def render_pes(
             continue
         color = (thread.get_red(), thread.get_green(), thread.get_blue())
 
-        columns = _extract_satin_columns(block)
+        # Satin and tatami detection look at the same segment directions
+        dirs = _stitch_dirs(block)
+        columns = _extract_satin_columns(block, dirs)
         if columns:
+            # Every column shades the same way, so work the fills out once
+            fills = _satin_fills(color, lw)
             for left, right in columns:
-                _render_satin_column(draw, left, right, color, lw)
+                _render_satin_column(draw, left, right, fills, lw)
             continue
 
-        is_tatami = _tatami_score(block) >= 0.45
-        if not is_tatami and len(block) >= 50 and not columns:
-            is_tatami = True
+        # Blocks of 50+ stitches are drawn as tatami whatever they score
+        is_tatami = len(block) >= 50 or _tatami_score(block, dirs) >= 0.45
         pts: List[Tuple[float, float]] = [(float(x), float(y)) for (x, y, _cmd) in block]
 
         if is_tatami:
@@ -320,15 +371,20 @@ def render_pes(
             gain = _direction_gain(x1 - x0, y1 - y0)
             shade = max(min(base * gain, 1.8), 0.2)
             rgb = _apply_shade(color, shade)
-            draw.line((x0, y0, x1, y1), fill=rgb + (255,), width=lw, joint="curve")
-
-    img.save(png_path)
+            draw.line((x0, y0, x1, y1), fill=rgb + (255,), width=lw)
 
     if output_base64:
+        # Encode once and reuse the bytes for both the file and stdout
         buffer = io.BytesIO()
         img.save(buffer, format="PNG")
-        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
-        print(encoded)
+        data = buffer.getvalue()
+        if hasattr(png_path, "write"):
+            png_path.write(data)
+        else:
+            pathlib.Path(png_path).write_bytes(data)
+        print(base64.b64encode(data).decode("ascii"))
+    else:
+        img.save(png_path, format="PNG")
 
     return png_path
 